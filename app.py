@@ -6,10 +6,16 @@ import warnings
 warnings.filterwarnings("ignore", message="Core Pydantic V1 functionality")
 
 import streamlit as st
-import tempfile
 import os
-import time
+import hashlib
+import tempfile
+import uuid
 from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from compliance import check_compliance, embed_text
 
 # Page configuration - must be first Streamlit command
 st.set_page_config(
@@ -19,154 +25,30 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for styling
-st.markdown("""
-<style>
-    /* Main container styling */
-    .main {
-        padding: 2rem;
-    }
-    
-    /* Header styling */
-    .header-container {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        margin-bottom: 2rem;
-        color: white;
-        text-align: center;
-    }
-    
-    .header-title {
-        font-size: 2.5rem;
-        font-weight: 700;
-        margin-bottom: 0.5rem;
-    }
-    
-    .header-subtitle {
-        font-size: 1.1rem;
-        opacity: 0.9;
-    }
-    
-    /* Score display */
-    .score-container {
-        text-align: center;
-        padding: 2rem;
-        border-radius: 15px;
-        margin: 1rem 0;
-    }
-    
-    .score-high {
-        background: linear-gradient(135deg, #11998e 0%, #38ef7d 100%);
-        color: white;
-    }
-    
-    .score-medium {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        color: white;
-    }
-    
-    .score-low {
-        background: linear-gradient(135deg, #eb3349 0%, #f45c43 100%);
-        color: white;
-    }
-    
-    .score-value {
-        font-size: 4rem;
-        font-weight: 700;
-    }
-    
-    .score-label {
-        font-size: 1.2rem;
-        opacity: 0.9;
-    }
-    
-    /* Violation card */
-    .violation-card {
-        background: #fff;
-        border-left: 4px solid #f45c43;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 0 10px 10px 0;
-        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-    }
-    
-    .violation-header {
-        font-weight: 600;
-        color: #333;
-        margin-bottom: 0.5rem;
-    }
-    
-    .severity-badge {
-        display: inline-block;
-        padding: 0.2rem 0.6rem;
-        border-radius: 20px;
-        font-size: 0.75rem;
-        font-weight: 600;
-        text-transform: uppercase;
-    }
-    
-    .severity-high {
-        background: #fee2e2;
-        color: #dc2626;
-    }
-    
-    .severity-medium {
-        background: #fef3c7;
-        color: #d97706;
-    }
-    
-    .severity-low {
-        background: #dbeafe;
-        color: #2563eb;
-    }
-    
-    /* Upload area */
-    .upload-section {
-        background: #f8fafc;
-        padding: 1.5rem;
-        border-radius: 15px;
-        border: 2px dashed #cbd5e1;
-        margin: 1rem 0;
-    }
-    
-    /* Button styling */
-    .stButton > button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        padding: 0.75rem 2rem;
-        font-size: 1.1rem;
-        font-weight: 600;
-        border-radius: 10px;
-        width: 100%;
-        transition: transform 0.2s;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-2px);
-    }
-    
-    /* Info boxes */
-    .info-box {
-        color:black;
-        background: #eff6ff;
-        border: 1px solid #bfdbfe;
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-    }
-    
-    /* Success message */
-    .success-box {
-        background: #ecfdf5;
-        border: 1px solid #a7f3d0;
-        padding: 1.5rem;
-        border-radius: 10px;
-        text-align: center;
-    }
-</style>
-""", unsafe_allow_html=True)
+STYLES_PATH = Path(__file__).parent / "styles.css"
+
+# Uploads larger than this are rejected before any Gemini call
+MAX_PDF_BYTES = 25 * 1024 * 1024
+
+# Uploaded PDFs are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Opt-in: drafts at least this similar to a cached one (same rules PDF) reuse its report.
+# Off by default - a "fix the flagged phrase and re-check" edit is near-identical in embedding
+# space, and would get back the stale violations quoting text the user already removed.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+
+@st.cache_resource
+def load_styles() -> str:
+    """Read the custom CSS once per server process instead of on every rerun"""
+    return f"<style>\n{STYLES_PATH.read_text(encoding='utf-8')}</style>"
+
+
+def render_styles():
+    """Inject the custom CSS (must be re-emitted on each rerun to stay applied)"""
+    st.markdown(load_styles(), unsafe_allow_html=True)
 
 
 def render_header():
@@ -203,12 +85,19 @@ def render_score(score: float, is_compliant: bool, total_violations: int):
     """, unsafe_allow_html=True)
 
 
-def render_violation(violation: dict, index: int):
-    """Render a single violation card"""
+SEVERITY_CLASSES = {
+    'high': 'severity-high',
+    'medium': 'severity-medium',
+    'low': 'severity-low'
+}
+
+
+def violation_html(violation: dict, index: int) -> str:
+    """Build the HTML for a single violation card"""
     severity = violation.get('severity', 'medium').lower()
-    severity_class = f"severity-{severity}" if severity in ['high', 'medium', 'low'] else "severity-medium"
+    severity_class = SEVERITY_CLASSES.get(severity, "severity-medium")
     
-    st.markdown(f"""
+    return f"""
     <div class="violation-card">
         <div class="violation-header">
             {index}. {violation.get('rule_category', 'Unknown Category')}
@@ -217,11 +106,124 @@ def render_violation(violation: dict, index: int):
         <p><strong>Issue:</strong> {violation.get('violation_text', 'No details')}</p>
         <p><strong>Suggestion:</strong> {violation.get('correction_suggestion', 'No suggestion')}</p>
     </div>
-    """, unsafe_allow_html=True)
+    """
+
+
+def render_violations(violations: list):
+    """Render all violation cards in a single markdown element"""
+    html = "".join(violation_html(v, i) for i, v in enumerate(violations, 1))
+    st.markdown(html, unsafe_allow_html=True)
+
+
+def is_pdf(uploaded_file) -> bool:
+    """Check the PDF magic bytes without reading the whole upload"""
+    uploaded_file.seek(0)
+    head = uploaded_file.read(4)
+    uploaded_file.seek(0)
+    return head == b"%PDF"
+
+
+def save_upload(uploaded_file) -> tuple[str, str]:
+    """Stream the uploaded PDF to a temp file, hashing it in the same pass"""
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            tmp_file.write(chunk)
+    return tmp_file.name, digest.hexdigest()
+
+
+def embed_draft(text: str) -> Optional[np.ndarray]:
+    """Embed the draft as a unit vector, or None if embedding is unavailable"""
+    try:
+        vector = np.asarray(embed_text(text), dtype=np.float32)
+    except Exception:
+        return None
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def lookup_cached_result(pdf_hash: str, draft_hash: str) -> Optional[dict]:
+    """Return a cached report for the same rules PDF and an identical draft"""
+    for entry in st.session_state.get("compliance_cache", []):
+        if entry["pdf_hash"] == pdf_hash and entry["draft_hash"] == draft_hash:
+            return entry["result"]
+    return None
+
+
+def has_cached_results(pdf_hash: str) -> bool:
+    """Whether any report for this rules PDF is cached in this session"""
+    return any(entry["pdf_hash"] == pdf_hash for entry in st.session_state.get("compliance_cache", []))
+
+
+def lookup_similar_result(pdf_hash: str, draft_embedding: Optional[np.ndarray]) -> Optional[dict]:
+    """Return a cached report for the same rules PDF and a near-identical draft"""
+    if draft_embedding is None:
+        return None
+    best_similarity, best_result = 0.0, None
+    for entry in st.session_state.get("compliance_cache", []):
+        if entry["pdf_hash"] != pdf_hash or entry["embedding"] is None:
+            continue
+        similarity = float(np.dot(entry["embedding"], draft_embedding))
+        if similarity > best_similarity:
+            best_similarity, best_result = similarity, entry["result"]
+    return best_result if best_similarity >= SEMANTIC_CACHE_THRESHOLD else None
+
+
+def store_cached_result(pdf_hash: str, draft_hash: str, draft_embedding: Optional[np.ndarray], result: dict):
+    """Remember a successful report for later lookups in this session"""
+    st.session_state.setdefault("compliance_cache", []).append({
+        "pdf_hash": pdf_hash,
+        "draft_hash": draft_hash,
+        "embedding": draft_embedding,
+        "result": result
+    })
+
+
+@st.fragment
+def render_report(result: dict):
+    """Render the compliance report panel"""
+    st.markdown("---")
+    st.subheader("📊 Compliance Report")
+
+    if result.get("status") == "success":
+        report = result.get("report", {})
+
+        # Score display
+        render_score(
+            score=report.get("overallScore", 0),
+            is_compliant=report.get("is_compliant", False),
+            total_violations=report.get("totalViolations", 0)
+        )
+
+        # Confidence
+        confidence = report.get("detectionConfidence", "Unknown")
+        st.info(f"🎯 Detection Confidence: **{confidence}**")
+
+        # Violations
+        violations = report.get("violations", [])
+        if violations:
+            st.subheader("⚠️ Violations Found")
+            render_violations(violations)
+        else:
+            st.markdown("""
+            <div class="success-box">
+                <h3>🎉 Perfect Compliance!</h3>
+                <p>No violations were found in your document.</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+    elif result.get("status") == "failed":
+        errors = result.get("errors", ["Unknown error"])
+        st.error(f"❌ Compliance check failed: {', '.join(errors)}")
+    else:
+        st.error(f"❌ Error: {result.get('message', 'Unknown error occurred')}")
 
 
 def main():
     """Main application"""
+    render_styles()
     render_header()
     
     # Description section
@@ -265,70 +267,49 @@ def main():
     if check_button:
         if not uploaded_file:
             st.error("⚠️ Please upload a rules PDF first")
+        elif uploaded_file.size > MAX_PDF_BYTES:
+            st.error(f"⚠️ PDF exceeds the {MAX_PDF_BYTES // (1024 * 1024)} MB limit")
+        elif not is_pdf(uploaded_file):
+            st.error("⚠️ The uploaded file is not a valid PDF")
         elif not user_content or len(user_content.strip()) < 10:
             st.error("⚠️ Please enter some content to check (at least 10 characters)")
         else:
             # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(uploaded_file.read())
-                tmp_path = tmp_file.name
+            tmp_path, pdf_hash = save_upload(uploaded_file)
+            draft_hash = hashlib.sha256(user_content.encode("utf-8")).hexdigest()
             
             try:
                 with st.spinner("🔄 Analyzing document for compliance..."):
-                    # Import and run compliance check
-                    from compliance import check_compliance
-                    
-                    result = check_compliance(
-                        user_id=f"streamlit_user_{int(time.time())}",
-                        file_path=tmp_path,
-                        draft_text=user_content,
-                        cleanup_after=True
-                    )
-                
-                # Display results
-                st.markdown("---")
-                st.subheader("📊 Compliance Report")
-                
-                if result.get("status") == "success":
-                    report = result.get("report", {})
-                    
-                    # Score display
-                    render_score(
-                        score=report.get("overallScore", 0),
-                        is_compliant=report.get("is_compliant", False),
-                        total_violations=report.get("totalViolations", 0)
-                    )
+                    draft_embedding = None
+                    result = lookup_cached_result(pdf_hash, draft_hash)
+                    # No cached reports for this PDF means nothing to compare against: skip the embed call
+                    if result is None and SEMANTIC_CACHE_ENABLED and has_cached_results(pdf_hash):
+                        draft_embedding = embed_draft(user_content)
+                        result = lookup_similar_result(pdf_hash, draft_embedding)
                     
-                    # Confidence
-                    confidence = report.get("detectionConfidence", "Unknown")
-                    st.info(f"🎯 Detection Confidence: **{confidence}**")
-                    
-                    # Violations
-                    violations = report.get("violations", [])
-                    if violations:
-                        st.subheader("⚠️ Violations Found")
-                        for i, v in enumerate(violations, 1):
-                            render_violation(v, i)
-                    else:
-                        st.markdown("""
-                        <div class="success-box">
-                            <h3>🎉 Perfect Compliance!</h3>
-                            <p>No violations were found in your document.</p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                    if result is None:
+                        result = check_compliance(
+                            user_id=st.session_state.setdefault("user_id", f"streamlit_user_{uuid.uuid4().hex}"),
+                            file_path=tmp_path,
+                            draft_text=user_content,
+                            cleanup_after=True
+                        )
+                        
+                        if result.get("status") == "success":
+                            store_cached_result(pdf_hash, draft_hash, draft_embedding, result)
                 
-                elif result.get("status") == "failed":
-                    errors = result.get("errors", ["Unknown error"])
-                    st.error(f"❌ Compliance check failed: {', '.join(errors)}")
-                else:
-                    st.error(f"❌ Error: {result.get('message', 'Unknown error occurred')}")
+                st.session_state["last_result"] = result
                     
             except Exception as e:
+                st.session_state.pop("last_result", None)
                 st.error(f"❌ Error: {str(e)}")
             finally:
-                # Cleanup temp file
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
+                # Cleanup temp file (check_compliance only removes the remote copy)
+                Path(tmp_path).unlink(missing_ok=True)
+    
+    # Results persist across reruns; only the report fragment re-renders on its own
+    if "last_result" in st.session_state:
+        render_report(st.session_state["last_result"])
     
     # Footer
     st.markdown("---")
@@ -1,15 +1,16 @@
 # --- IMPORTS ---
 import os
-from typing import TypedDict, Optional, List
-from pydantic import BaseModel
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from google import genai
-from dotenv import load_dotenv
+import random
+import asyncio
+import operator
+from weakref import WeakKeyDictionary
+from dataclasses import dataclass, field
+from typing import Annotated, Optional, List
+from pydantic import BaseModel, TypeAdapter
+import httpx
+from google.genai import errors
 
-load_dotenv()
-
-# Initialize client for retry function
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+from gemini_client import get_client, load_env
 
 # --- 1. DEFINE STATE & SCHEMA ---
 
@@ -26,28 +27,154 @@ class ComplianceReport(BaseModel):
     totalViolations: int
     violations: List[ComplianceViolation]
 
-class ComplianceState(TypedDict):
+# JSON schemas generated once and sent as response_json_schema; passing the models instead
+# would make the SDK regenerate them from the pydantic classes on every call
+COMPLIANCE_REPORT_SCHEMA = ComplianceReport.model_json_schema()
+COMPLIANCE_REPORT_LIST_SCHEMA = TypeAdapter(list[ComplianceReport]).json_schema()
+
+@dataclass(slots=True)
+class ComplianceState:
     user_id: str
     user_content: str
-    file_path: Optional[str]  # Local file path for user's rules PDF
-    store_name: Optional[str]
-    metadata_filter: Optional[str]
-    file_to_cleanup: Optional[str]
-    mode: Optional[str]
-    extracted_rules: Optional[str]
-    compliance_report: str
-    errors: List[str]
+    file_path: Optional[str] = None  # Local file path for user's rules PDF
+    store_name: Optional[str] = None
+    metadata_filter: Optional[str] = None
+    file_to_cleanup: Optional[str] = None
+    file_id: Optional[str] = None  # Store file_id of a rules upload made by this run
+    mode: Optional[str] = None
+    extracted_rules: Optional[str] = None
+    inline_rules_file: Optional[str] = None  # Files API URI of a small rules PDF verified directly
+    prepared_content: Optional[str] = None  # Normalized draft, built in parallel with extraction
+    compliance_report: Optional[str] = None
+    errors: Annotated[List[str], operator.add] = field(default_factory=list)  # Nodes return only their new errors
 
 
 # --- 2. RETRY LOGIC ---
-@retry(
-    stop=stop_after_attempt(4),
-    wait=wait_exponential(multiplier=2, min=2, max=20),
-    retry=retry_if_exception_type(Exception)
-)
-def call_gemini_with_retry(model, contents, config):
-    return client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=config
-    )
+# Client errors other than timeouts/quota (bad request, auth, not found) never succeed on retry
+RETRYABLE_CLIENT_CODES = {408, 429}
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """True for transient failures: 5xx, request timeout, quota, network errors."""
+    if isinstance(exc, errors.ServerError):
+        return True
+    if isinstance(exc, errors.ClientError):
+        return exc.code in RETRYABLE_CLIENT_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """True for quota exhaustion (HTTP 429)."""
+    return isinstance(exc, errors.ClientError) and exc.code == 429
+
+
+# Quota errors need long, jittered backoff; other transient errors clear up quickly
+RATE_LIMIT_ATTEMPTS = 6
+TRANSIENT_ATTEMPTS = 3
+MAX_RETRY_DELAY = 120
+
+
+def _server_retry_delay(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After header or google.rpc.RetryInfo), if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    retry_after = headers.get("retry-after") if headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    details = getattr(exc, "details", None)
+    error = details.get("error") if isinstance(details, dict) else None
+    for detail in (error or {}).get("details") or []:
+        if isinstance(detail, dict) and detail.get("@type", "").endswith("RetryInfo"):
+            try:
+                return float(str(detail.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                return None
+    return None
+
+
+def _retry_delay(exc: BaseException, attempt: int) -> float:
+    """Wait before the next attempt: the server's hint if given, else exponential backoff."""
+    hint = _server_retry_delay(exc)
+    if hint is not None:
+        return min(hint, MAX_RETRY_DELAY)
+    if is_rate_limited(exc):
+        return min(max(5 * 2 ** (attempt - 1), 10), MAX_RETRY_DELAY) + random.uniform(0, 5)
+    return min(max(2 ** (attempt - 1), 0.5), 4)
+
+
+def _should_retry(exc: BaseException, attempt: int) -> bool:
+    if not is_retryable_error(exc):
+        return False
+    return attempt < (RATE_LIMIT_ATTEMPTS if is_rate_limited(exc) else TRANSIENT_ATTEMPTS)
+
+
+# --- 3. CONCURRENCY LIMIT ---
+# Caps in-flight Gemini calls so a burst of 429s backs off as a small queue, not a herd.
+# Slots are held only for the call itself, never during a retry wait.
+_loop_semaphores: "WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = WeakKeyDictionary()
+
+
+def _max_inflight() -> int:
+    load_env()
+    return int(os.getenv("GEMINI_MAX_INFLIGHT", "8"))
+
+
+def _async_inflight() -> asyncio.Semaphore:
+    """Semaphore for the running event loop (asyncio primitives cannot be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    semaphore = _loop_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _loop_semaphores[loop] = asyncio.Semaphore(_max_inflight())
+    return semaphore
+
+
+async def _aretrying(call):
+    """Awaits call() until it succeeds or fails with a non-retryable error / out of attempts."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await call()
+        except Exception as e:
+            if not _should_retry(e, attempt):
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+async def acall_gemini_with_retry(model, contents, config):
+    """Calls generate_content on the client's aio surface, retrying transient failures."""
+    async def call():
+        async with _async_inflight():
+            return await get_client().aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            )
+
+    return await _aretrying(call)
+
+
+async def astream_gemini_with_retry(model, contents, config, on_chunk=None) -> str:
+    """
+    Streaming variant of acall_gemini_with_retry; returns the accumulated text.
+    on_chunk(buffer) is called after every chunk - returning True stops reading early.
+    """
+    async def call():
+        async with _async_inflight():
+            buffer = ""
+            stream = await get_client().aio.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=config
+            )
+            async for chunk in stream:
+                buffer += chunk.text or ""
+                if on_chunk and on_chunk(buffer):
+                    await stream.aclose()
+                    break
+            return buffer
+
+    return await _aretrying(call)
@@ -2,183 +2,620 @@ import warnings
 warnings.filterwarnings("ignore", message="Core Pydantic V1 functionality")
 
 import os
-import time
+import logging
+import asyncio
+import threading
+import concurrent.futures
 import json
+import re
+import hashlib
+from dataclasses import replace
+from functools import lru_cache, wraps
+from types import MappingProxyType
+from uuid import uuid4
 
-from typing import Optional, Dict, Any
-from google import genai
-from google.genai import types
-from langgraph.graph import StateGraph, END
-from dotenv import load_dotenv
+import orjson
+from cachetools import TTLCache
 
-load_dotenv()
+from typing import Optional, Dict, Any, List, Tuple, Set, Callable, AsyncIterator
+from google.genai import types
 
 
 # --- IMPORTS ---
-from compliance_file_store import ComplianceFileStoreManager
-from compilance_states import ComplianceViolation, ComplianceReport, ComplianceState, call_gemini_with_retry
-from prompt import Extract_rules_prompt, verify_compliance_system_instruction, get_verify_compliance_prompt
+from compliance_file_store import ComplianceFileStoreManager, tenant_doc_filter, file_sha256
+from gemini_client import get_client, load_env
+from compilance_states import (
+    ComplianceState,
+    COMPLIANCE_REPORT_SCHEMA,
+    COMPLIANCE_REPORT_LIST_SCHEMA,
+    acall_gemini_with_retry,
+    astream_gemini_with_retry
+)
+from prompt import (
+    Extract_rules_prompt,
+    EXTRACT_PROMPT_VERSION,
+    verify_compliance_system_instruction,
+    get_verify_compliance_prompt,
+    get_verify_compliance_batch_prompt,
+    INLINE_RULES_REFERENCE
+)
+import rules_cache
 
 # --- INITIALIZE ---
-file_store_manager = ComplianceFileStoreManager()
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+logger = logging.getLogger(__name__)
+load_env()
 MODEL_ID = os.getenv("MODEL_ID")
+# Extraction is near-mechanical summarization and can run on a cheaper, faster model
+EXTRACT_MODEL_ID = os.getenv("EXTRACT_MODEL_ID", MODEL_ID)
+VERIFY_MODEL_ID = os.getenv("VERIFY_MODEL_ID", MODEL_ID)
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "text-embedding-004")
+# Rules PDFs up to this size skip extraction; verify reads the PDF itself in one call
+INLINE_RULES_MAX_BYTES = int(os.getenv("INLINE_RULES_MAX_BYTES", "100000"))
+# Optional: persist graph checkpoints so a failed run resumes after its last completed node
+CHECKPOINT_REDIS_URL = os.getenv("CHECKPOINT_REDIS_URL")
+# Checkpoints only matter for retrying a failed run soon after; expire them so threads don't pile up
+CHECKPOINT_TTL_MINUTES = float(os.getenv("CHECKPOINT_TTL_MINUTES", "60"))
+
+# Only used to detect when a streamed report is a complete JSON value
+_JSON_DECODER = json.JSONDecoder()
+
+# Pieces of an extracted rules line, used to tell "None explicitly stated." filler from real rules
+_LINE_MARKER_RE = re.compile(r'^[\s#>*_\-\u2022]*(?:\(?\d+[.)]\s*)?[\s*_]*')
+_LABEL_RE = re.compile(r'^[A-Za-z][\w /&()\-]{0,60}:\s*')
+_HEADING_RE = re.compile(
+    r'^(?:data privacy(?:\s*/\s*pii)?|citation style|document structure(?:\s*(?:&|and)\s*formatting)?'
+    r'|restricted/required phrasing(?:\s*\(governance\))?)\s*:?$',
+    re.I
+)
+_NONE_STATED_RE = re.compile(r'^none explicitly stated\.?$', re.I)
+NO_RULES_REPORT = orjson.dumps({
+    "is_compliant": True,
+    "overallScore": 100,
+    "detectionConfidence": "HIGH",
+    "totalViolations": 0,
+    "violations": []
+}).decode()
+
+
+# --- VERIFY CONFIG ---
+
+_VERIFY_SCHEMAS = {
+    "single": COMPLIANCE_REPORT_SCHEMA,
+    "batch": COMPLIANCE_REPORT_LIST_SCHEMA
+}
+
+
+@lru_cache(maxsize=2)
+def _verify_config(kind: str) -> types.GenerateContentConfig:
+    """Verify config per response shape ("single" or "batch"), built once and shared (the SDK only reads it)."""
+    return types.GenerateContentConfig(
+        system_instruction=verify_compliance_system_instruction,
+        temperature=0.3,
+        response_mime_type="application/json",
+        response_json_schema=_VERIFY_SCHEMAS[kind]
+    )
+
+
+# --- VERIFY BATCHING ---
+
+
+async def _stream_report(contents, on_progress: Optional[Callable] = None) -> str:
+    """Streams one compliance report, reporting progress and stopping once the JSON is complete."""
+    def on_chunk(buffer: str) -> bool:
+        if on_progress:
+            on_progress({"stage": "verify", "received_chars": len(buffer)})
+        # Stop reading as soon as the report is a complete JSON object. It can only be
+        # complete when the buffer ends in "}", so other chunks skip the re-parse.
+        if not buffer.rstrip().endswith("}"):
+            return False
+        try:
+            _JSON_DECODER.raw_decode(buffer.lstrip())
+            return True
+        except ValueError:
+            return False
+
+    return await astream_gemini_with_retry(
+        model=VERIFY_MODEL_ID,
+        contents=contents,
+        config=_verify_config("single"),
+        on_chunk=on_chunk
+    )
+
+
+class BatchedVerifier:
+    """
+    Coalesces verify requests that share the same rules and arrive within a short
+    window into one multi-draft Gemini call. A lone request goes out as a normal call.
+    Requests only share a batch within one scope (user and rules document), so one
+    tenant's draft never appears in another tenant's prompt.
+    """
+
+    def __init__(self, window: float = 0.05, max_batch: int = 20):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Tuple[asyncio.AbstractEventLoop, Tuple, str], List[Tuple[str, asyncio.Future, Optional[Callable]]]] = {}
+        # The loop only keeps weak references to tasks; hold running batches until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        rules: str,
+        draft: str,
+        on_progress: Optional[Callable] = None,
+        scope: Tuple = ()
+    ) -> str:
+        """
+        Queues one draft and returns its compliance report JSON.
+        on_progress receives progress events while a lone draft's report streams in.
+        scope (e.g. user_id and rules document) must match for drafts to share a call.
+        """
+        loop = asyncio.get_running_loop()
+        key = (loop, scope, rules)
+        future = loop.create_future()
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            loop.call_later(self.window, self._flush, key, batch)
+        batch.append((draft, future, on_progress))
+
+        if len(batch) >= self.max_batch:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        # The timer may fire after the batch was already flushed for being full
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        task = asyncio.ensure_future(self._run(key[2], batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, rules: str, batch: List[Tuple[str, asyncio.Future, Optional[Callable]]]):
+        try:
+            if len(batch) == 1:
+                draft, _, on_progress = batch[0]
+                reports = [await self._verify_one(rules, draft, on_progress)]
+            else:
+                reports = await self._verify_many(rules, [draft for draft, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), report in zip(batch, reports):
+            if not future.done():
+                future.set_result(report)
+
+    async def _verify_one(self, rules: str, draft: str, on_progress: Optional[Callable] = None) -> str:
+        return await _stream_report(get_verify_compliance_prompt(rules, draft), on_progress)
+
+    async def _verify_many(self, rules: str, drafts: List[str]) -> List[str]:
+        logger.debug("[VERIFY] Batching %s drafts into one call", len(drafts))
+        response = await acall_gemini_with_retry(
+            model=VERIFY_MODEL_ID,
+            contents=get_verify_compliance_batch_prompt(rules, drafts),
+            config=_verify_config("batch")
+        )
+        try:
+            reports = orjson.loads(response.text)
+        except orjson.JSONDecodeError:
+            reports = None
+
+        if not isinstance(reports, list) or len(reports) != len(drafts):
+            # The model did not return one report per draft; check them individually
+            logger.warning("[VERIFY] Batch response malformed, falling back to single calls")
+            return list(await asyncio.gather(*(self._verify_one(rules, d) for d in drafts)))
+        return [orjson.dumps(report).decode() for report in reports]
+
+
+batched_verifier = BatchedVerifier()
+
+
+# --- LAZY RESOURCES ---
+# Built on first use so importing this module stays cheap (no client, no graph compile)
+
+@lru_cache(maxsize=1)
+def get_file_store_manager() -> ComplianceFileStoreManager:
+    """Returns the shared file store manager, creating it on first use."""
+    return ComplianceFileStoreManager()
 
 
 # --- LANGGRAPH NODES ---
 
-def node_setup_context(state: ComplianceState):
+def _setup_context(state: ComplianceState) -> Dict[str, Any]:
     """
     DECISION NODE: Sets up context for user's uploaded rules.
     User must upload their rules PDF - no admin fallback.
     """
-    user_id = state.get('user_id')
-    file_path = state.get('file_path')  # Local file path
+    user_id = state.user_id
+    file_path = state.file_path  # Local file path
     
     if not user_id:
-        return {"errors": state.get('errors', []) + ["Missing user_id"]}
+        return {"errors": ["Missing user_id"]}
     
-    if not file_path:
-        return {"errors": state.get('errors', []) + ["Missing file_path - user must upload a rules PDF"]}
-    
-    # Check if context already set up
-    if state.get("store_name") and state.get("mode") == "custom":
-        print(f"[CONTEXT] Using existing context - Store: {state['store_name']}")
+    # Check if context already set up (pre-uploaded rules have no file_path)
+    if state.store_name and state.mode == "custom":
+        logger.debug("[CONTEXT] Using existing context - Store: %s", state.store_name)
         return {
-            "store_name": state["store_name"],
-            "metadata_filter": state.get("metadata_filter"),
-            "file_to_cleanup": state.get("file_to_cleanup"),
-            "mode": state["mode"]
+            "store_name": state.store_name,
+            "metadata_filter": state.metadata_filter,
+            "file_to_cleanup": state.file_to_cleanup,
+            "mode": state.mode
         }
+    
+    if not file_path:
+        return {"errors": ["Missing file_path - user must upload a rules PDF"]}
 
     try:
-        # Generate file_id from timestamp
-        file_id = f"user_{user_id}_{int(time.time())}"
+        # Unique per run: cleanup deletes by file_id, so concurrent runs for one user must not share it
+        file_id = f"user_{user_id}_{uuid4().hex}"
         
         # Upload user's rules document
-        upload_result = file_store_manager.upload_user_document(
+        upload_result = get_file_store_manager().upload_user_document(
             file_path=file_path,
             user_id=user_id,
             file_id=file_id
         )
         
         if upload_result.get("status") != "success":
-            return {"errors": state.get('errors', []) + [upload_result.get("message", "Upload failed")]}
+            return {"errors": [upload_result.get("message", "Upload failed")]}
         
-        print(f"[CONTEXT] Mode: custom, Store: {upload_result['store_name']}")
+        logger.debug("[CONTEXT] Mode: custom, Store: %s", upload_result['store_name'])
         
+        inline = upload_result.get("google_file_uri") and os.path.getsize(file_path) <= INLINE_RULES_MAX_BYTES
         return {
             "store_name": upload_result["store_name"],
-            "metadata_filter": f'user_id = "{user_id}" AND file_id = "{file_id}"',
+            "metadata_filter": tenant_doc_filter(user_id, file_id),
             "file_to_cleanup": upload_result.get("google_file_name"),
+            "file_id": file_id,
+            "inline_rules_file": upload_result["google_file_uri"] if inline else None,
             "mode": "custom"
         }
         
     except Exception as e:
-        print(f"[CONTEXT] Setup failed: {e}")
-        return {"errors": state.get('errors', []) + [f"Context setup failed: {str(e)}"]}
+        logger.error("[CONTEXT] Setup failed: %s", e)
+        return {"errors": [f"Context setup failed: {str(e)}"]}
 
 
-def node_extract_rules(state: ComplianceState):
+async def _extract_rules(state: ComplianceState) -> Dict[str, Any]:
     """
     Extracts compliance rules from the user's uploaded document.
     """
-    if not state.get("store_name"):
+    if not state.store_name:
         return {"extracted_rules": "ERROR: No store configured."}
 
-    print(f"[EXTRACT] Extracting rules from user document...")
-
     try:
-        # Build file search tool with metadata filter
-        file_search_tool = types.Tool(
-            file_search=types.FileSearch(
-                file_search_store_names=[state['store_name']],
-                metadata_filter=state.get('metadata_filter')
-            )
-        )
+        cache_key = _rules_cache_key(state.store_name, state.metadata_filter)
+        # SQLite may wait on another process's write lock; keep it off the shared loop
+        cached_rules = await asyncio.to_thread(rules_cache.lookup, cache_key)
+        if cached_rules:
+            logger.debug("[EXTRACT] Using cached rules")
+            return {"extracted_rules": cached_rules}
 
-        response = call_gemini_with_retry(
-            model=MODEL_ID,
+        logger.debug("[EXTRACT] Extracting rules from user document...")
+
+        response = await acall_gemini_with_retry(
+            model=EXTRACT_MODEL_ID,
             contents=Extract_rules_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.0,
-                tools=[file_search_tool]
-            )
+            config=_extract_config(state.store_name, state.metadata_filter)
         )
 
-        print(f"[EXTRACT] Successfully extracted rules")
+        # An all-"None" extraction is also what an unindexed or filter-mismatched document
+        # yields, so only cache output that actually contains rules
+        if response.text and _has_any_rule(response.text):
+            await asyncio.to_thread(rules_cache.store, cache_key, response.text)
+
+        logger.debug("[EXTRACT] Successfully extracted rules")
         return {"extracted_rules": response.text}
 
     except Exception as e:
-        print(f"[EXTRACT] Failed: {e}")
-        return {"extracted_rules": f"Error: {str(e)}", "errors": state.get('errors', []) + [str(e)]}
+        logger.error("[EXTRACT] Failed: %s", e)
+        return {"extracted_rules": f"Error: {str(e)}", "errors": [str(e)]}
+
+
+async def node_setup_and_extract(state: ComplianceState):
+    """
+    Sets up the user's rules context and extracts the rules from it in one step,
+    saving a graph step between the two.
+    """
+    # Upload and import are blocking; keep them off the event loop
+    context = await asyncio.to_thread(_setup_context, state)
+    if "errors" in context or context.get("inline_rules_file"):
+        # Small rules PDFs are read by verify directly, so there is nothing to extract
+        return context
+    if state.extracted_rules is not None:
+        # Extracted up front by the caller (batch checks share one extraction)
+        return context
+    
+    extracted = await _extract_rules(replace(state, **context))
+    return {**context, **extracted}
+
+
+def node_prepare_content(state: ComplianceState):
+    """
+    Normalizes the draft for the verify prompt.
+    Only needs the draft, so it runs in parallel with rule extraction.
+    """
+    content = state.user_content or ""
+    prepared = "\n".join(line.rstrip() for line in content.replace("\r\n", "\n").split("\n")).strip()
+    return {"prepared_content": prepared}
 
 
-def node_verify_compliance(state: ComplianceState):
+async def node_verify_compliance(state: ComplianceState):
     """
     Verifies user content against extracted rules.
     """
-    rules = state.get('extracted_rules', "")
+    if state.inline_rules_file:
+        return await _verify_against_rules_file(state)
+
+    rules = state.extracted_rules or ""
     if "ERROR" in rules or not rules:
         return {"compliance_report": '{"error": "SKIPPED: Rules could not be extracted."}'}
 
-    user_input = state['user_content']
+    if not _has_any_rule(rules):
+        # Nothing to check against, so the report is known without a model call
+        logger.debug("[VERIFY] No explicit rules in policy, skipping verification")
+        return {"compliance_report": NO_RULES_REPORT}
+
+    user_input = state.prepared_content or state.user_content
+
+    from langgraph.config import get_stream_writer
 
     try:
-        # Get the formatted prompt with rules and user input
-        verify_prompt = get_verify_compliance_prompt(rules, user_input)
-        
-        response = call_gemini_with_retry(
-            model=MODEL_ID,
-            contents=verify_prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=verify_compliance_system_instruction,
-                temperature=0.3,
-                response_mime_type="application/json",
-                response_schema=ComplianceReport
-            )
+        # Concurrent checks against the same rules are coalesced into one call
+        report = await batched_verifier.submit(
+            rules, user_input, get_stream_writer(), scope=(state.user_id, state.metadata_filter)
         )
         
-        print(f"[VERIFY] Compliance check completed")
-        return {"compliance_report": response.text}
+        logger.debug("[VERIFY] Compliance check completed")
+        return {"compliance_report": report}
 
     except Exception as e:
-        print(f"[VERIFY] Failed: {e}")
-        return {"errors": state.get('errors', []) + [f"Verification failed: {str(e)}"]}
+        logger.error("[VERIFY] Failed: %s", e)
+        return {"errors": [f"Verification failed: {str(e)}"]}
+
+
+async def _verify_against_rules_file(state: ComplianceState) -> Dict[str, Any]:
+    """Single-call path: the model reads the small rules PDF itself instead of extracted rules."""
+    from langgraph.config import get_stream_writer
 
+    try:
+        report = await _stream_report(
+            [
+                types.Part.from_uri(file_uri=state.inline_rules_file, mime_type="application/pdf"),
+                get_verify_compliance_prompt(INLINE_RULES_REFERENCE, state.prepared_content or state.user_content)
+            ],
+            get_stream_writer()
+        )
+        logger.debug("[VERIFY] Compliance check completed against inline rules file")
+        return {"compliance_report": report}
 
-def node_cleanup(state: ComplianceState):
+    except Exception as e:
+        logger.error("[VERIFY] Failed: %s", e)
+        return {"errors": [f"Verification failed: {str(e)}"]}
+
+
+async def node_cleanup(state: ComplianceState):
     """
     Cleans up user-uploaded files after compliance check.
+    The delete runs in the background so the report is returned without waiting on it.
     """
-    file_to_cleanup = state.get('file_to_cleanup')
-    
-    if file_to_cleanup:
-        try:
-            client.files.delete(name=file_to_cleanup)
-            print(f"[CLEANUP] Deleted temporary file: {file_to_cleanup}")
-        except Exception as e:
-            print(f"[CLEANUP] Failed to delete file: {e}")
-    else:
-        print(f"[CLEANUP] No file to cleanup")
+    file_to_cleanup = state.file_to_cleanup
+    if not file_to_cleanup:
+        return {}
     
+    # The document is going away, so rules extracted from it can never be hit again
+    await asyncio.to_thread(rules_cache.delete, _rules_cache_key(state.store_name, state.metadata_filter))
+    _delete_uploaded_file(state)
     return {}
 
 
+def _route_after_verify(state: ComplianceState) -> str:
+    """Only visit cleanup when there is an uploaded file to delete."""
+    return "cleanup" if state.file_to_cleanup else "end"
+
+
+def _delete_uploaded_file(state: ComplianceState):
+    """
+    Hands the delete to the file store's cleanup thread, which (unlike a task on the
+    caller's event loop) is not cancelled when the loop shuts down and is joined at exit.
+    """
+    manager = get_file_store_manager()
+    if state.file_id:
+        # Through the manager, so its file index stays accurate and files shared by
+        # content dedup are only deleted with their last reference
+        future = manager.cleanup_user_file_async(state.user_id, state.file_id, state.store_name)
+    else:
+        # Checkpointed runs from before file_id was recorded
+        future = manager.delete_file_async(state.file_to_cleanup)
+    future.add_done_callback(_log_cleanup)
+
+
+def _log_cleanup(future: concurrent.futures.Future):
+    try:
+        result = future.result() or {"status": "success", "message": "Deleted temporary file"}
+    except Exception as e:
+        logger.error("[CLEANUP] Failed to delete file: %s", e)
+        return
+    if result.get("status") == "error":
+        logger.error("[CLEANUP] Failed to delete file: %s", result.get("message"))
+    else:
+        logger.debug("[CLEANUP] %s", result.get("message"))
+
+
 # --- BUILD GRAPH ---
-workflow = StateGraph(ComplianceState)
-workflow.add_node("setup", node_setup_context)
-workflow.add_node("extract", node_extract_rules)
-workflow.add_node("verify", node_verify_compliance)
-workflow.add_node("cleanup", node_cleanup)
+@lru_cache(maxsize=1)
+def get_compliance_app():
+    """Builds and compiles the compliance graph on first use."""
+    from langgraph.graph import StateGraph, START, END
+
+    workflow = StateGraph(ComplianceState)
+    workflow.add_node("setup_and_extract", node_setup_and_extract)
+    workflow.add_node("prepare", node_prepare_content)
+    workflow.add_node("verify", node_verify_compliance)
+    workflow.add_node("cleanup", node_cleanup)
+
+    # Fan out: extraction and prepare run in parallel, verify waits for both
+    workflow.add_edge(START, "setup_and_extract")
+    workflow.add_edge(START, "prepare")
+    workflow.add_edge(["setup_and_extract", "prepare"], "verify")
+    workflow.add_conditional_edges("verify", _route_after_verify, {"cleanup": "cleanup", "end": END})
+    workflow.add_edge("cleanup", END)
+
+    return workflow.compile(checkpointer=_get_checkpointer())
 
-workflow.set_entry_point("setup")
-workflow.add_edge("setup", "extract")
-workflow.add_edge("extract", "verify")
-workflow.add_edge("verify", "cleanup")
-workflow.add_edge("cleanup", END)
 
-compliance_app = workflow.compile()
+def _get_checkpointer():
+    """Redis checkpointer when CHECKPOINT_REDIS_URL is set (needs langgraph-checkpoint-redis), else None."""
+    if not CHECKPOINT_REDIS_URL:
+        return None
+    from langgraph.checkpoint.redis.aio import AsyncRedisSaver
+    return AsyncRedisSaver(redis_url=CHECKPOINT_REDIS_URL, ttl={"default_ttl": CHECKPOINT_TTL_MINUTES})
+
+
+_checkpointer_ready = False
+
+
+async def _graph_run_args(inputs: dict, thread_id: str) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Returns the (input, config) to run the graph with.
+    With a checkpointer, a run on the same thread that stopped partway for the same draft
+    is resumed (input None) instead of replaying the completed nodes.
+    """
+    from langgraph.types import Overwrite
+
+    global _checkpointer_ready
+    app = get_compliance_app()
+    if app.checkpointer is None:
+        return inputs, None
+
+    if not _checkpointer_ready and hasattr(app.checkpointer, "asetup"):
+        await app.checkpointer.asetup()
+        _checkpointer_ready = True
+
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = await app.aget_state(config)
+    if snapshot.next and snapshot.values.get("user_content") == inputs["user_content"]:
+        logger.info("[GRAPH] Resuming thread %s at %s", thread_id, ', '.join(snapshot.next))
+        return None, config
+    # A fresh run must not inherit errors accumulated by an earlier run on this thread
+    return {**inputs, "errors": Overwrite(inputs.get("errors") or [])}, config
+
+
+# --- EVENT LOOP ---
+# Every entry point, sync or async, runs on one background loop instead of the caller's:
+# the client's async connection pool is bound to the loop that first used it.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the background event loop, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="compliance-loop", daemon=True).start()
+    return _loop
+
+
+def _run_sync(coro):
+    """Runs a coroutine on the background loop and blocks until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def _on_shared_loop(func):
+    """Runs the decorated coroutine function on the background loop, whichever loop awaits it."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = _get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await func(*args, **kwargs)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop))
+    return wrapper
+
+
+def _stream_on_shared_loop(func):
+    """Like _on_shared_loop, for async generators: each item is produced on the background loop."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = _get_loop()
+        agen = func(*args, **kwargs)
+        if asyncio.get_running_loop() is loop:
+            async for item in agen:
+                yield item
+            return
+
+        async def step():
+            try:
+                return False, await agen.__anext__()
+            except StopAsyncIteration:
+                return True, None
+
+        try:
+            while True:
+                done, item = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(step(), loop))
+                if done:
+                    return
+                yield item
+        finally:
+            # The caller stopped early (or finished); close the generator where it runs
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop)
+    return wrapper
+
+
+# Every graph run starts from this template; callers overlay only what they set
+_GRAPH_INPUT_TEMPLATE = MappingProxyType({
+    "file_path": None,
+    "store_name": None,
+    "metadata_filter": None,
+    "file_to_cleanup": None,
+    "file_id": None,
+    "mode": None,
+    "extracted_rules": None,
+    "errors": []
+})
+
+
+def _graph_input(**overrides) -> Dict[str, Any]:
+    """Builds the graph's input state from the template and per-request values."""
+    return {**_GRAPH_INPUT_TEMPLATE, **overrides}
+
+
+# Identical checks already running on a loop, so duplicates (retries, double clicks) share one run
+_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+
+async def _ainvoke(rules_ref: str, **overrides) -> Dict[str, Any]:
+    """Runs the graph for one draft and returns the parsed result."""
+    thread_id = _thread_id(overrides["user_id"], rules_ref, overrides["user_content"])
+    loop = asyncio.get_running_loop()
+    key = (loop, thread_id)
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        logger.debug("[API] Joining in-flight check %s", thread_id)
+        # Shielded so one waiter giving up does not cancel the shared run
+        return dict(await asyncio.shield(pending))
+
+    future = _inflight[key] = loop.create_future()
+    try:
+        inputs, config = await _graph_run_args(_graph_input(**overrides), thread_id=thread_id)
+        result = _parse_result(await get_compliance_app().ainvoke(inputs, config))
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Marks it retrieved when nobody else was waiting
+        raise
+    finally:
+        del _inflight[key]
 
 
 # =============================================================================
@@ -198,11 +635,31 @@ def upload_user_rules(file_path: str, user_id: str, file_id: str) -> Dict[str, A
     Returns:
         Upload result with status
     """
-    print(f"[API] Upload user rules - user: {user_id}, file: {file_id}")
-    return file_store_manager.upload_user_document(file_path, user_id, file_id)
+    logger.info("[API] Upload user rules - user: %s, file: %s", user_id, file_id)
+    manager = get_file_store_manager()
+    result = manager.upload_user_document(file_path, user_id, file_id)
+    
+    if result.get("status") == "success":
+        # Success means the import operation has finished indexing. Warm it in the background:
+        # the first file_search on a new document is slow, and this fills the rules cache
+        context = manager.get_user_context(user_id, file_id)
+        # A re-upload under the same ids replaces the document; drop what was derived from the old one
+        _evict_document(user_id, file_id, context)
+        warmup = asyncio.run_coroutine_threadsafe(
+            _extract_rules(ComplianceState(user_id=user_id, user_content="", **context)),
+            _get_loop()
+        )
+        _warmup_futures.add(warmup)
+        warmup.add_done_callback(_warmup_futures.discard)
+    
+    return result
 
 
-def check_compliance(
+_warmup_futures: Set[concurrent.futures.Future] = set()
+
+
+@_on_shared_loop
+async def acheck_compliance(
     user_id: str, 
     file_path: str, 
     draft_text: str,
@@ -220,20 +677,14 @@ def check_compliance(
     Returns:
         Compliance report
     """
-    print(f"[API] Check compliance - user: {user_id}, file: {file_path}")
+    logger.info("[API] Check compliance - user: %s, file: %s", user_id, file_path)
     
-    # Run compliance check
-    final_state = compliance_app.invoke({
-        "user_id": user_id,
-        "user_content": draft_text,
-        "file_path": file_path,
-        "errors": []
-    })
-    
-    return _parse_result(final_state)
+    rules_ref = await asyncio.to_thread(_rules_file_ref, file_path)
+    return await _ainvoke(rules_ref, user_id=user_id, user_content=draft_text, file_path=file_path)
 
 
-def check_compliance_with_uploaded_rules(
+@_on_shared_loop
+async def acheck_compliance_with_uploaded_rules(
     user_id: str, 
     file_id: str, 
     draft_text: str,
@@ -251,28 +702,165 @@ def check_compliance_with_uploaded_rules(
     Returns:
         Compliance report
     """
-    print(f"[API] Check with pre-uploaded rules - user: {user_id}, file: {file_id}")
+    logger.info("[API] Check with pre-uploaded rules - user: %s, file: %s", user_id, file_id)
+    
+    return await _check_with_uploaded_rules(user_id, file_id, draft_text, cleanup_after)
+
+
+async def _check_with_uploaded_rules(
+    user_id: str,
+    file_id: str,
+    draft_text: str,
+    cleanup_after: bool = False,
+    context: Optional[Dict[str, Any]] = None,
+    extracted: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Body of acheck_compliance_with_uploaded_rules. Batch checks pass the resolved context and
+    their single _extract_rules result, so no draft's run extracts again.
+    """
+    result_key = _result_key(user_id, file_id, draft_text)
+    with _result_cache_lock:
+        cached = _result_cache.get(result_key)
+    if cached is not None and not cleanup_after:
+        logger.debug("[API] Returning cached result")
+        return dict(cached)
     
     # Get context for the pre-uploaded file
-    context = file_store_manager.get_user_context(user_id, file_id)
+    if context is None:
+        context = await asyncio.to_thread(get_file_store_manager().get_user_context, user_id, file_id)
     
-    # Run compliance check
-    final_state = compliance_app.invoke({
-        "user_id": user_id,
-        "user_content": draft_text,
-        "file_path": None,  # Already uploaded
-        "store_name": context["store_name"],
-        "metadata_filter": context["metadata_filter"],
-        "file_to_cleanup": None,  # Don't auto-cleanup
-        "mode": "custom",
-        "errors": []
-    })
+    # Already uploaded: no file_path, and the graph must not auto-cleanup
+    result = await _ainvoke(
+        file_id,
+        user_id=user_id,
+        user_content=draft_text,
+        store_name=context["store_name"],
+        metadata_filter=context["metadata_filter"],
+        mode="custom",
+        **(extracted or {})
+    )
     
     # Optional cleanup
     if cleanup_after:
-        file_store_manager.cleanup_user_file(user_id, file_id)
+        # Deletion isn't user-visible, so don't hold the response for it
+        get_file_store_manager().cleanup_user_file_async(user_id, file_id, context["store_name"])
+        await asyncio.to_thread(_evict_document, user_id, file_id, context)
+    elif result.get("status") == "success":
+        with _result_cache_lock:
+            _result_cache[result_key] = result
+    
+    return result
+
+
+@_stream_on_shared_loop
+async def astream_compliance(
+    user_id: str, 
+    file_path: str, 
+    draft_text: str
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    PUBLIC API: Like acheck_compliance, but yields progress events while the report streams in.
+    
+    Args:
+        user_id: User identifier
+        file_path: Local path to the rules PDF
+        draft_text: Text to check for compliance
+        
+    Yields:
+        Progress events, then {"stage": "done", "result": <compliance result>}
+    """
+    logger.info("[API] Stream compliance - user: %s, file: %s", user_id, file_path)
+    
+    rules_ref = await asyncio.to_thread(_rules_file_ref, file_path)
+    inputs, config = await _graph_run_args(
+        _graph_input(user_id=user_id, user_content=draft_text, file_path=file_path),
+        thread_id=_thread_id(user_id, rules_ref, draft_text)
+    )
+    
+    final_state: dict = {}
+    async for mode, chunk in get_compliance_app().astream(inputs, config, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            yield chunk
+        else:
+            final_state = chunk
+    
+    yield {"stage": "done", "result": _parse_result(final_state)}
+
+
+@_on_shared_loop
+async def acheck_compliance_batch(
+    user_id: str, 
+    file_id: str, 
+    drafts: List[str]
+) -> List[Dict[str, Any]]:
+    """
+    PUBLIC API: Check several drafts against the user's previously uploaded rules.
+    Rules are extracted once; the drafts' verify calls are coalesced into
+    multi-draft requests (up to BatchedVerifier.max_batch drafts each).
+    
+    Args:
+        user_id: User identifier
+        file_id: File identifier of uploaded rules
+        drafts: Texts to check for compliance
+        
+    Returns:
+        One compliance result per draft, in order
+    """
+    logger.info("[API] Batch check - user: %s, file: %s, drafts: %s", user_id, file_id, len(drafts))
+    
+    # Extract once and hand the result (rules, or the extraction error) to every draft's run
+    context = await asyncio.to_thread(get_file_store_manager().get_user_context, user_id, file_id)
+    extracted = await _extract_rules(ComplianceState(user_id=user_id, user_content="", **context))
     
-    return _parse_result(final_state)
+    return list(await asyncio.gather(*(
+        _check_with_uploaded_rules(user_id, file_id, draft, context=context, extracted=extracted)
+        for draft in drafts
+    )))
+
+
+def check_compliance(
+    user_id: str, 
+    file_path: str, 
+    draft_text: str,
+    cleanup_after: bool = True
+) -> Dict[str, Any]:
+    """PUBLIC API: Blocking wrapper around acheck_compliance."""
+    return _run_sync(acheck_compliance(user_id, file_path, draft_text, cleanup_after))
+
+
+def check_compliance_with_uploaded_rules(
+    user_id: str, 
+    file_id: str, 
+    draft_text: str,
+    cleanup_after: bool = False
+) -> Dict[str, Any]:
+    """PUBLIC API: Blocking wrapper around acheck_compliance_with_uploaded_rules."""
+    return _run_sync(acheck_compliance_with_uploaded_rules(user_id, file_id, draft_text, cleanup_after))
+
+
+def check_compliance_batch(
+    user_id: str, 
+    file_id: str, 
+    drafts: List[str]
+) -> List[Dict[str, Any]]:
+    """PUBLIC API: Blocking wrapper around acheck_compliance_batch."""
+    return _run_sync(acheck_compliance_batch(user_id, file_id, drafts))
+
+
+def embed_text(text: str) -> List[float]:
+    """
+    PUBLIC API: Embeds text with the embedding model.
+    Much cheaper than a full compliance check - used by callers to detect near-duplicate drafts.
+    
+    Args:
+        text: Text to embed
+        
+    Returns:
+        Embedding vector
+    """
+    response = get_client().models.embed_content(model=EMBEDDING_MODEL_ID, contents=text)
+    return response.embeddings[0].values
 
 
 def delete_user_rules(user_id: str, file_id: str) -> Dict[str, Any]:
@@ -286,11 +874,98 @@ def delete_user_rules(user_id: str, file_id: str) -> Dict[str, Any]:
     Returns:
         Deletion result
     """
-    print(f"[API] Delete user rules - user: {user_id}, file: {file_id}")
-    return file_store_manager.cleanup_user_file(user_id, file_id)
+    logger.info("[API] Delete user rules - user: %s, file: %s", user_id, file_id)
+    manager = get_file_store_manager()
+    context = manager.get_user_context(user_id, file_id)
+    _evict_document(user_id, file_id, context)
+    return manager.cleanup_user_file(user_id, file_id, context["store_name"])
 
 
 # --- HELPER ---
+# Final results for pre-uploaded rules, keyed by (user_id, file_id, draft hash).
+# Checks against a local file_path are not cached: the same path may hold a different PDF later.
+# Evictions only reach this process, so the TTL bounds how long other workers can serve
+# results computed against a replaced document.
+RESULT_CACHE_TTL = 300
+_result_cache: TTLCache = TTLCache(maxsize=4096, ttl=RESULT_CACHE_TTL)
+_result_cache_lock = threading.Lock()
+
+
+def _result_key(user_id: str, file_id: str, draft_text: str) -> Tuple[str, str, bytes]:
+    return (user_id, file_id, hashlib.blake2b(draft_text.encode("utf-8"), digest_size=16).digest())
+
+
+def _evict_results(user_id: str, file_id: str):
+    """Drops every cached result computed against one rules document."""
+    with _result_cache_lock:
+        for key in [k for k in _result_cache if k[0] == user_id and k[1] == file_id]:
+            _result_cache.pop(key, None)
+
+
+def _evict_document(user_id: str, file_id: str, context: Dict[str, Any]):
+    """Drops the extracted rules and the results derived from one rules document."""
+    rules_cache.delete(_rules_cache_key(context["store_name"], context["metadata_filter"]))
+    _evict_results(user_id, file_id)
+
+
+@lru_cache(maxsize=256)
+def _make_file_search_tool(store_name: str, metadata_filter: Optional[str]) -> types.Tool:
+    """File search tool scoped to one document; store/filter pairs repeat, so tools are shared."""
+    return types.Tool(
+        file_search=types.FileSearch(
+            file_search_store_names=[store_name],
+            metadata_filter=metadata_filter
+        )
+    )
+
+
+@lru_cache(maxsize=256)
+def _extract_config(store_name: str, metadata_filter: Optional[str]) -> types.GenerateContentConfig:
+    """Generation config for the extract stage, built once per store/filter pair."""
+    return types.GenerateContentConfig(
+        temperature=0.0,
+        tools=[_make_file_search_tool(store_name, metadata_filter)]
+    )
+
+
+def _has_any_rule(rules: str) -> bool:
+    """
+    False only when every non-heading line of the extraction is exactly "None explicitly stated."
+    (after its bullet or number and any "Label:" prefix). Anything else - a mixed bullet, a
+    paragraph, a numbered sub-item - counts as a rule, so verification runs.
+    """
+    for line in rules.splitlines():
+        body = _LINE_MARKER_RE.sub('', line).strip().rstrip('*_ ').strip()
+        if not body or _HEADING_RE.match(body):
+            continue
+        value = _LABEL_RE.sub('', body).strip(' "\'*_')
+        if not _NONE_STATED_RE.match(value):
+            return True
+    return False
+
+
+def _rules_file_ref(file_path: str) -> str:
+    """
+    Identifies a local rules PDF by content, so runs on fresh temp copies of one PDF share
+    a checkpoint thread and a reused path holding a different PDF does not.
+    """
+    try:
+        return "sha256:" + file_sha256(file_path)
+    except (OSError, ValueError):
+        # Missing or empty: setup fails before anything worth resuming is checkpointed
+        return file_path
+
+
+def _thread_id(user_id: str, rules_ref: str, draft_text: str) -> str:
+    """Checkpoint thread for one draft against one rules document; concurrent drafts never share a thread."""
+    return f"{user_id}:{rules_ref}:{rules_cache.make_key(draft_text)[:16]}"
+
+
+def _rules_cache_key(store_name: str, metadata_filter: Optional[str]) -> str:
+    """Cache key for rules extracted from one document with the current model and prompt."""
+    return rules_cache.make_key(store_name, metadata_filter, EXTRACT_MODEL_ID, EXTRACT_PROMPT_VERSION)
+
+
 def _parse_result(final_state: dict) -> Dict[str, Any]:
     """Parses the final state into a clean result."""
     if final_state.get("errors"):
@@ -299,14 +974,14 @@ def _parse_result(final_state: dict) -> Dict[str, Any]:
             "errors": final_state["errors"]
         }
     
-    if "compliance_report" in final_state:
+    if final_state.get("compliance_report") is not None:
         try:
-            report = json.loads(final_state["compliance_report"])
+            report = orjson.loads(final_state["compliance_report"])
             return {
                 "status": "success",
                 "report": report
             }
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return {
                 "status": "error",
                 "message": "Model returned invalid JSON",
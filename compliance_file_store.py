@@ -7,14 +7,205 @@ Handles user uploads only - users must upload their own rules PDF.
 from __future__ import annotations
 
 import os
+import json
+import mmap
+import hashlib
+import logging
 import time
 import tempfile
-from typing import Optional, Dict, Any
+import threading
+from pathlib import Path
+from functools import cached_property, lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any, Tuple, List, Set
 
-from google import genai
-from dotenv import load_dotenv
+from cachetools import TTLCache
+from cachetools.keys import hashkey
 
-load_dotenv()
+from gemini_client import get_client, load_env
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Store display name -> resource name, shared by every manager in the process
+_STORE_CACHE: Dict[str, str] = {}
+_STORE_LOCK = threading.Lock()
+
+# Resolved store names are also persisted so new processes skip the store listing.
+# Store ids are stable, so a day is plenty; a store that vanishes sooner is re-resolved on 404.
+STORE_ID_CACHE_TTL = 24 * 3600
+_STORE_EXPIRY: Dict[str, float] = {}
+_store_file_loaded = False
+# Display names pinned by USER_STORE_ID; never expire and never persisted
+_PINNED_STORES: Set[str] = set()
+
+# (user_id, file_id) -> context; store assignments rarely change, so a short TTL is enough
+_CONTEXT_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+_CONTEXT_LOCK = threading.Lock()
+
+# Largest page the file_search_stores.list endpoint serves (fewer round trips per scan)
+STORE_LIST_PAGE_SIZE = 20
+
+# Polling for uploads still PROCESSING and imports still indexing: exponential backoff with a cap
+UPLOAD_POLL_INITIAL_DELAY = 0.05
+UPLOAD_POLL_MAX_DELAY = 1.0
+UPLOAD_PROCESSING_TIMEOUT = 120
+IMPORT_INDEXING_TIMEOUT = 300
+
+# How long a store's document listing is reused for cleanup lookups
+DOC_INDEX_TTL = 30
+
+# File Search rejects documents larger than this, so don't spend an upload on them
+MAX_RULES_FILE_BYTES = 100 * 1024 * 1024
+
+# Uploads are network-bound, so a handful of threads overlap them well
+UPLOAD_MAX_WORKERS = 8
+
+
+def tenant_doc_key(user_id: str, file_id: str) -> str:
+    """
+    Composite key identifying one user's document, stored as its own metadata field.
+    Colons and backslashes inside the ids are escaped, so only one pair of ids maps to each key
+    (ids without them keep the plain "user_id::file_id" form).
+    """
+    return f"{_key_part(user_id)}::{_key_part(file_id)}"
+
+
+def _key_part(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace(':', '\\:')
+
+
+@lru_cache(maxsize=4096)
+def tenant_doc_filter(user_id: str, file_id: str) -> str:
+    """Single-key equality filter on tenant_doc, which file_search can apply as a pre-filter."""
+    return f'tenant_doc = "{_filter_literal(tenant_doc_key(user_id, file_id))}"'
+
+
+@lru_cache(maxsize=4096)
+def legacy_doc_filter(user_id: str, file_id: str) -> str:
+    """Two-field filter for documents uploaded before tenant_doc metadata existed."""
+    return f'user_id = "{_filter_literal(str(user_id))}" AND file_id = "{_filter_literal(str(file_id))}"'
+
+
+def _filter_literal(value: str) -> str:
+    """Escapes a value so a quote in an id can't end the string literal and widen the filter."""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+@lru_cache(maxsize=None)
+def _cache_path(env_var: str, filename: str) -> Path:
+    """Location of a persisted cache file; resolved on first use so the env override may come from .env."""
+    load_env()
+    return Path(os.getenv(env_var, Path.home() / ".cache" / "compliance" / filename))
+
+
+def _store_id_cache_path() -> Path:
+    """Persisted store ids (STORE_ID_CACHE_PATH overrides)."""
+    return _cache_path("STORE_ID_CACHE_PATH", "stores.json")
+
+
+def _file_index_cache_path() -> Path:
+    """Persisted uploaded-file index, so cleanup after a restart still skips the document listing
+    (FILE_INDEX_CACHE_PATH overrides)."""
+    return _cache_path("FILE_INDEX_CACHE_PATH", "file_index.json")
+
+
+def _read_json_map(path: Path) -> Dict[str, Any]:
+    """Reads a persisted JSON object; a missing or corrupt file reads as empty."""
+    try:
+        stored = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    return stored if isinstance(stored, dict) else {}
+
+
+def _write_json_map(path: Path, data: Dict[str, Any]):
+    """Atomically replaces a persisted JSON object; best effort, a failure only costs a listing later."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=path.parent, delete=False) as tmp:
+            json.dump(data, tmp)
+        os.replace(tmp.name, path)
+    except OSError as e:
+        logger.warning("[FileStoreManager] Could not persist %s: %s", path.name, e)
+
+
+def _load_store_ids():
+    """Seeds _STORE_CACHE from the unexpired persisted store ids, once per process."""
+    global _store_file_loaded
+    if _store_file_loaded:
+        return
+    _store_file_loaded = True
+    now = time.time()
+    for display_name, entry in _read_json_map(_store_id_cache_path()).items():
+        if isinstance(entry, list) and len(entry) == 2 and entry[1] > now:
+            _STORE_CACHE.setdefault(display_name, entry[0])
+            _STORE_EXPIRY.setdefault(display_name, entry[1])
+
+
+def _cached_store_id(display_name: str) -> Optional[str]:
+    """Returns the cached store id unless its TTL has lapsed; env-pinned ids have no expiry."""
+    if time.time() < _STORE_EXPIRY.get(display_name, float('inf')):
+        return _STORE_CACHE.get(display_name)
+    return None
+
+
+def _remember_store_id(display_name: str, store_id: str):
+    """Caches a resolved store id in memory and on disk for STORE_ID_CACHE_TTL."""
+    _STORE_CACHE[display_name] = store_id
+    _STORE_EXPIRY[display_name] = time.time() + STORE_ID_CACHE_TTL
+    _write_json_map(_store_id_cache_path(), {
+        name: [sid, _STORE_EXPIRY[name]] for name, sid in _STORE_CACHE.items()
+        if name in _STORE_EXPIRY and name not in _PINNED_STORES
+    })
+
+
+def _pin_store_id(display_name: str, store_id: str):
+    """Pins a store id from the environment: no expiry, and it overrides any persisted id."""
+    _PINNED_STORES.add(display_name)
+    _STORE_CACHE[display_name] = store_id
+    _STORE_EXPIRY.pop(display_name, None)
+
+
+def file_sha256(file_path: str) -> str:
+    """Hex sha256 of a non-empty file's bytes, hashed from a mapping in a single native update."""
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.sha256(mm).hexdigest()
+
+
+def _poll(current, refresh, pending, timeout: float, what: str):
+    """Re-fetches current with capped exponential backoff while pending(current); returns the final value."""
+    delay = UPLOAD_POLL_INITIAL_DELAY
+    deadline = time.monotonic() + timeout
+    while pending(current):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"{what} still pending after {timeout}s")
+        time.sleep(delay)
+        delay = min(delay * 1.7, UPLOAD_POLL_MAX_DELAY)
+        current = refresh(current)
+    return current
+
+
+def _client_error_code(exc: Exception) -> Optional[int]:
+    """HTTP status of a Gemini 4xx error, else None. Imports the SDK only once an error exists."""
+    from google.genai import errors
+    return exc.code if isinstance(exc, errors.ClientError) else None
+
+
+def _md(key: str, value: str) -> Dict[str, str]:
+    """One string custom_metadata entry in the shape import_file accepts."""
+    return {'key': key, 'string_value': value}
+
+
+def _meta_value(m):
+    """Returns the populated value of a custom_metadata entry."""
+    value = getattr(m, 'string_value', None)
+    return value if value is not None else getattr(m, 'numeric_value', None)
+
+
+def _meta_dict(doc) -> Dict[str, Any]:
+    """Flattens a document's custom_metadata into a {key: value} dict."""
+    return {m.key: _meta_value(m) for m in getattr(doc, 'custom_metadata', None) or []}
 
 
 class ComplianceFileStoreManager:
@@ -24,15 +215,41 @@ class ComplianceFileStoreManager:
     """
 
     def __init__(self):
-        self.client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        load_env()
+
+        # tenant_doc_key -> google_file_name for known uploads, mirrored to the file index cache
+        self._file_index: Dict[str, str] = _read_json_map(_file_index_cache_path())
+        self._file_index_lock = threading.Lock()
+
+        # Background deletions; failures are logged by cleanup_user_file and never reach the caller
+        self._cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-cleanup")
+
+        # sha256 of uploaded bytes -> google_file_name, so re-uploads of the same PDF skip files.upload
+        self._content_index: Dict[str, str] = {}
+
+        # store_id -> (user_id, file_id) of documents without a current tenant_doc key. Every new
+        # upload gets one, so the set can only shrink and is listed once per process
+        self._legacy_docs: Dict[str, Set[Tuple[str, str]]] = {}
+
+        # store_id -> (built_at, {(user_id, file_id): (document name, google_file_name, has current tenant_doc)})
+        self._doc_index: Dict[str, Tuple[float, Dict[Tuple[str, str], Tuple[str, Optional[str], bool]]]] = {}
+        # Uploads, cleanups and to_thread workers all touch the listings; iterate and mutate under this
+        self._doc_index_lock = threading.Lock()
 
         # --- STORE CONFIGURATION ---
         self.USER_STORE_NAME = "Compliance_User_Uploads_v1"
-        
-        # Cache store ID
-        self._user_store_id = None
 
-        print("[FileStoreManager] Initialized ComplianceFileStoreManager")
+        # Deployments can pin the store and bypass discovery entirely
+        _load_store_ids()
+        if os.getenv("USER_STORE_ID"):
+            _pin_store_id(self.USER_STORE_NAME, os.getenv("USER_STORE_ID"))
+
+        logger.debug("[FileStoreManager] Initialized ComplianceFileStoreManager")
+
+    @cached_property
+    def client(self):
+        """The shared Gemini client, built on first use so construction stays cheap."""
+        return get_client()
 
     # =========================================================================
     # PUBLIC API
@@ -42,7 +259,8 @@ class ComplianceFileStoreManager:
         self,
         file_path: str,
         user_id: str,
-        file_id: str
+        file_id: str,
+        upload_time: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         Uploads a user's custom rules document to the User Store.
@@ -52,57 +270,112 @@ class ComplianceFileStoreManager:
             file_path: Local path to the PDF file
             user_id: User identifier
             file_id: Unique file identifier
+            upload_time: Epoch seconds recorded in metadata; defaults to now
 
         Returns:
             Upload result with status and metadata
         """
         try:
-            # Validate file exists
-            if not os.path.exists(file_path):
+            # Validate the file once (missing -> FileNotFoundError below) and reject bad sizes up front
+            size = os.stat(file_path).st_size
+            if size == 0:
+                return {
+                    "status": "error",
+                    "message": f"File is empty: {file_path}"
+                }
+            if size > MAX_RULES_FILE_BYTES:
                 return {
                     "status": "error",
-                    "message": f"File not found: {file_path}"
+                    "message": f"File exceeds {MAX_RULES_FILE_BYTES // (1024 * 1024)} MB limit: {file_path}"
                 }
 
-            store_id = self._get_or_create_store(self.USER_STORE_NAME)
+            # Reject non-PDFs before spending an upload and Gemini processing on them
+            with open(file_path, 'rb') as f:
+                if f.read(5) != b'%PDF-':
+                    return {
+                        "status": "error",
+                        "message": f"Not a PDF file: {file_path}"
+                    }
 
-            google_file_name = self._upload_from_local_path(
-                store_name=store_id,
-                file_path=file_path,
-                metadata=[
-                    {'key': 'user_id', 'string_value': str(user_id)},
-                    {'key': 'file_id', 'string_value': str(file_id)},
-                    {'key': 'type', 'string_value': 'custom_upload'},
-                    {'key': 'upload_time', 'string_value': str(int(time.time()))}
-                ]
-            )
+            store_id = self._get_or_create_store(self.USER_STORE_NAME)
 
-            print(f"[FileStoreManager] Upload success - user_id: {user_id}, file_id: {file_id}")
+            # Identical bytes already uploaded by this process only need a new import. The
+            # reference is taken before importing so a concurrent cleanup can't delete the File
+            doc_key = tenant_doc_key(user_id, file_id)
+            digest = file_sha256(file_path)
+            uploaded_file, previous = self._reuse_upload(digest, doc_key)
+            if uploaded_file is None:
+                uploaded_file = self._submit_upload(file_path)
+                self._update_file_index(doc_key, uploaded_file.name)
+
+            try:
+                try:
+                    uploaded_file = self._finalize_import(store_id, uploaded_file, self._user_metadata(user_id, file_id, upload_time))
+                except Exception as e:
+                    if _client_error_code(e) != 404:
+                        raise
+                    # The cached store id is stale (store deleted out-of-band); resolve it and re-import
+                    store_id = self._get_or_create_store(self.USER_STORE_NAME, refresh=True)
+                    uploaded_file = self._finalize_import(store_id, uploaded_file, self._user_metadata(user_id, file_id, upload_time))
+            except Exception:
+                # Release the reference taken above
+                self._update_file_index(doc_key, previous)
+                raise
+
+            with self._file_index_lock:
+                self._content_index[digest] = uploaded_file.name
+            # A cached context may predate this upload (e.g. a legacy filter for the replaced document)
+            with _CONTEXT_LOCK:
+                _CONTEXT_CACHE.pop(hashkey(user_id, file_id), None)
+            logger.info("[FileStoreManager] Upload success - user_id: %s, file_id: %s", user_id, file_id)
 
             return {
                 "status": "success",
                 "store_name": store_id,
                 "user_id": user_id,
                 "file_id": file_id,
-                "google_file_name": google_file_name,
+                "google_file_name": uploaded_file.name,
+                "google_file_uri": uploaded_file.uri,
                 "mode": "custom",
                 "message": "Custom rules uploaded and indexed successfully"
             }
 
         except FileNotFoundError as e:
-            print(f"[FileStoreManager] Upload failed - file not found: {e}")
+            logger.error("[FileStoreManager] Upload failed - file not found: %s", e)
             return {
                 "status": "error",
                 "message": f"File not found: {file_path}"
             }
         except Exception as e:
-            print(f"[FileStoreManager] Upload failed: {e}")
+            logger.error("[FileStoreManager] Upload failed: %s", e)
             return {
                 "status": "error",
                 "message": f"Upload failed: {str(e)}"
             }
 
-    def get_user_context(self, user_id: str, file_id: str) -> Dict[str, Any]:
+    def upload_user_documents(self, items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Uploads several rules documents concurrently.
+
+        Args:
+            items: Dicts with file_path, user_id and file_id, one per document
+
+        Returns:
+            Upload results in the same order as items
+        """
+        if not items:
+            return []
+
+        # Resolve the store up front so parallel uploads don't race to create it
+        self._get_or_create_store(self.USER_STORE_NAME)
+
+        # One timestamp for the whole batch; the shared client is thread-safe, so each
+        # worker only blocks on its own upload
+        upload_time = int(time.time())
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_MAX_WORKERS, len(items))) as ex:
+            return list(ex.map(lambda item: self.upload_user_document(**item, upload_time=upload_time), items))
+
+    def get_user_context(self, user_id: str, file_id: str, store_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Gets the context for a previously uploaded user document.
         Called when user clicks "Check Compliance" after uploading.
@@ -110,20 +383,28 @@ class ComplianceFileStoreManager:
         Args:
             user_id: User identifier
             file_id: File identifier
+            store_id: Already-resolved user store, skips the store lookup
 
         Returns:
             Context dict for compliance checking
         """
-        store_id = self._get_or_create_store(self.USER_STORE_NAME)
+        key = hashkey(user_id, file_id)
+        with _CONTEXT_LOCK:
+            context = _CONTEXT_CACHE.get(key)
+        if context is None:
+            store_id = store_id or self._get_or_create_store(self.USER_STORE_NAME)
+            context = {
+                "store_name": store_id,
+                "metadata_filter": self._metadata_filter(store_id, user_id, file_id),
+                "file_to_cleanup": None,  # Will be set after finding the file
+                "mode": "custom"
+            }
+            with _CONTEXT_LOCK:
+                _CONTEXT_CACHE[key] = context
 
-        return {
-            "store_name": store_id,
-            "metadata_filter": f'user_id = "{user_id}" AND file_id = "{file_id}"',
-            "file_to_cleanup": None,  # Will be set after finding the file
-            "mode": "custom"
-        }
+        return dict(context)
 
-    def cleanup_user_file(self, user_id: str, file_id: str) -> Dict[str, Any]:
+    def cleanup_user_file(self, user_id: str, file_id: str, store_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Deletes a user's uploaded file from the store.
         Called after compliance check or when user removes document.
@@ -131,105 +412,284 @@ class ComplianceFileStoreManager:
         Args:
             user_id: User identifier
             file_id: File identifier
+            store_id: Already-resolved user store, skips the store lookup
 
         Returns:
             Cleanup result
         """
-        try:
-            store_id = self._get_or_create_store(self.USER_STORE_NAME)
+        with _CONTEXT_LOCK:
+            _CONTEXT_CACHE.pop(hashkey(user_id, file_id), None)
 
-            # Find the file by metadata
-            files = list(self.client.file_search_stores.documents.list(
-                parent=store_id
-            ))
-
-            for f in files:
-                if hasattr(f, 'custom_metadata') and f.custom_metadata:
-                    meta_dict = {}
-                    for m in f.custom_metadata:
-                        if hasattr(m, 'string_value'):
-                            meta_dict[m.key] = m.string_value
-
-                    if meta_dict.get('user_id') == str(user_id) and meta_dict.get('file_id') == str(file_id):
-                        # Retrieve the actual file name from metadata if available
-                        file_to_delete = meta_dict.get('google_file_name')
-
-                        if file_to_delete:
-                            self.client.files.delete(name=file_to_delete)
-                            print(f"[FileStoreManager] Deleted file: {file_to_delete}")
-                            return {"status": "success", "message": f"Deleted file {file_to_delete}"}
-                        else:
-                            # Fallback: Delete the document from the store
-                            self.client.files.delete(name=f.name)
-                            return {"status": "success", "message": f"Deleted document {f.name}"}
-
-            return {"status": "not_found", "message": "File not found in store"}
+        key = (str(user_id), str(file_id))
+        try:
+            # Uploads made by this process are known without listing the store
+            google_file_name = self._update_file_index(tenant_doc_key(user_id, file_id), None)
+            if google_file_name:
+                self._forget_document(key)
+                self._delete_file(google_file_name)
+                logger.info("[FileStoreManager] Deleted file: %s", google_file_name)
+                return {"status": "success", "message": f"Deleted file {google_file_name}"}
+
+            store_id = store_id or self._get_or_create_store(self.USER_STORE_NAME)
+
+            # Find the file by metadata via the store's document index
+            try:
+                entry = self._document_index(store_id).get(key)
+            except Exception as e:
+                if _client_error_code(e) != 404:
+                    raise
+                store_id = self._get_or_create_store(self.USER_STORE_NAME, refresh=True)
+                entry = self._document_index(store_id).get(key)
+            if entry is None:
+                # The index may predate this upload; look again with a fresh listing
+                entry = self._document_index(store_id, refresh=True).get(key)
+            if entry is None:
+                return {"status": "not_found", "message": "File not found in store"}
+
+            doc_name, file_to_delete, _ = entry
+            self._forget_document(key)
+
+            # Retrieve the actual file name from metadata if available
+            if file_to_delete:
+                self._delete_file(file_to_delete)
+                logger.info("[FileStoreManager] Deleted file: %s", file_to_delete)
+                return {"status": "success", "message": f"Deleted file {file_to_delete}"}
+            else:
+                # Fallback: Delete the document from the store
+                self.client.files.delete(name=doc_name)
+                return {"status": "success", "message": f"Deleted document {doc_name}"}
 
         except Exception as e:
-            print(f"[FileStoreManager] Cleanup failed: {e}")
+            logger.error("[FileStoreManager] Cleanup failed: %s", e)
             return {"status": "error", "message": str(e)}
 
+    def cleanup_user_file_async(self, user_id: str, file_id: str, store_id: Optional[str] = None) -> Future:
+        """
+        Schedules cleanup_user_file on a background thread and returns immediately.
+
+        Returns:
+            Future resolving to the cleanup result
+        """
+        return self._cleanup_executor.submit(self.cleanup_user_file, user_id, file_id, store_id)
+
+    def delete_file_async(self, google_file_name: str) -> Future:
+        """
+        Schedules deletion of one uploaded File by name on the cleanup thread.
+        A File still shared with another upload through content dedup is kept.
+        """
+        return self._cleanup_executor.submit(self._delete_file, google_file_name)
+
     # =========================================================================
     # INTERNAL METHODS
     # =========================================================================
 
-    def _upload_from_local_path(self, store_name: str, file_path: str, metadata: list) -> str:
-        """Uploads a local file to Google File Store with metadata."""
+    @staticmethod
+    def _user_metadata(user_id: str, file_id: str, upload_time: Optional[int] = None) -> list:
+        """Custom metadata attached to a user's rules document in the store."""
+        return [
+            _md('user_id', str(user_id)),
+            _md('file_id', str(file_id)),
+            _md('tenant_doc', tenant_doc_key(user_id, file_id)),
+            _md('type', 'custom_upload'),
+            _md('upload_time', str(upload_time if upload_time is not None else int(time.time())))
+        ]
+
+    def _reuse_upload(self, digest: str, doc_key: str):
+        """
+        Returns (File, previous) when this content hash maps to a still-live File, else (None, previous).
+        A match is registered under doc_key atomically with the lookup; previous is the name the key
+        held before, for rolling back.
+        """
+        with self._file_index_lock:
+            google_file_name = self._content_index.get(digest)
+            previous = self._file_index.get(doc_key)
+            if not google_file_name:
+                return None, previous
+            self._file_index[doc_key] = google_file_name
+            _write_json_map(_file_index_cache_path(), self._file_index)
+        try:
+            return self.client.files.get(name=google_file_name), previous
+        except Exception as e:
+            if _client_error_code(e) is None:
+                self._update_file_index(doc_key, previous)
+                raise
+            # Expired or deleted; the caller uploads afresh and overwrites the reference
+            with self._file_index_lock:
+                if self._content_index.get(digest) == google_file_name:
+                    del self._content_index[digest]
+            return None, previous
+
+    def _delete_file(self, google_file_name: str):
+        """Deletes an uploaded File unless another indexed upload still shares it through content dedup."""
+        with self._file_index_lock:
+            if google_file_name in self._file_index.values():
+                logger.debug("[FileStoreManager] Keeping shared file: %s", google_file_name)
+                return
+            # Dropped under the lock, so no later upload can claim the File being deleted
+            for digest, name in list(self._content_index.items()):
+                if name == google_file_name:
+                    del self._content_index[digest]
+        self.client.files.delete(name=google_file_name)
+
+    def _update_file_index(self, doc_key: str, google_file_name: Optional[str]) -> Optional[str]:
+        """Sets (or, with None, removes) a file index entry and persists it. Returns the previous name."""
+        with self._file_index_lock:
+            if google_file_name:
+                previous = self._file_index.get(doc_key)
+                self._file_index[doc_key] = google_file_name
+            else:
+                previous = self._file_index.pop(doc_key, None)
+                if previous is None:
+                    return None
+            _write_json_map(_file_index_cache_path(), self._file_index)
+        return previous
+
+    def _metadata_filter(self, store_id: str, user_id: str, file_id: str) -> str:
+        """
+        tenant_doc filter for the document, or the legacy user_id/file_id filter when the
+        document was uploaded without a current tenant_doc key (it would match nothing otherwise).
+        """
+        if tenant_doc_key(user_id, file_id) in self._file_index:
+            return tenant_doc_filter(user_id, file_id)
+        if (str(user_id), str(file_id)) in self._legacy_doc_keys(store_id):
+            return legacy_doc_filter(user_id, file_id)
+        return tenant_doc_filter(user_id, file_id)
+
+    def _legacy_doc_keys(self, store_id: str) -> Set[Tuple[str, str]]:
+        """(user_id, file_id) of the store's legacy documents, from one listing per process."""
+        legacy = self._legacy_docs.get(store_id)
+        if legacy is None:
+            try:
+                index = self._document_index(store_id)
+            except Exception as e:
+                # Not remembered, so a later lookup lists again
+                logger.warning("[FileStoreManager] Could not list documents for filter choice: %s", e)
+                return set()
+            with self._doc_index_lock:
+                legacy = self._legacy_docs.setdefault(store_id, {key for key, entry in index.items() if not entry[2]})
+        return legacy
+
+    def _document_index(self, store_id: str, refresh: bool = False) -> Dict[Tuple[str, str], Tuple[str, Optional[str], bool]]:
+        """
+        Maps (user_id, file_id) -> (document name, google_file_name, has current tenant_doc) for
+        every document in a store. Built from one listing and reused for DOC_INDEX_TTL seconds.
+        """
+        with self._doc_index_lock:
+            cached = self._doc_index.get(store_id)
+        if cached and not refresh and time.monotonic() - cached[0] < DOC_INDEX_TTL:
+            return cached[1]
+
+        index = {}
+        for doc in self.client.file_search_stores.documents.list(parent=store_id):
+            meta = _meta_dict(doc)
+            key = (meta.get('user_id'), meta.get('file_id'))
+            index[key] = (
+                doc.name, meta.get('google_file_name'), meta.get('tenant_doc') == tenant_doc_key(*key)
+            )
+        with self._doc_index_lock:
+            self._doc_index[store_id] = (time.monotonic(), index)
+        return index
+
+    def _forget_document(self, key: Tuple[str, str]):
+        """Drops a deleted document from every cached listing."""
+        with self._doc_index_lock:
+            for _, index in list(self._doc_index.values()):
+                index.pop(key, None)
+
+    def _submit_upload(self, file_path: str):
+        """Uploads a local PDF to the Gemini Files API and returns the File without waiting on processing."""
         try:
-            # Upload to Gemini Files API
-            print(f"[FileStoreManager] Uploading file: {file_path}")
-            uploaded_file = self.client.files.upload(
+            logger.debug("[FileStoreManager] Uploading file: %s", file_path)
+            return self.client.files.upload(
                 file=file_path,
                 config={'mime_type': 'application/pdf'}
             )
+        except Exception as e:
+            logger.error("[FileStoreManager] Error uploading file: %s", e)
+            raise
 
-            # Wait for processing
-            while uploaded_file.state.name == "PROCESSING":
-                time.sleep(1)
-                uploaded_file = self.client.files.get(name=uploaded_file.name)
+    def _finalize_import(self, store_name: str, uploaded_file, metadata: list):
+        """Waits for an uploaded File to finish processing, then imports it into the store with metadata."""
+        try:
+            # Wait for processing; small files are usually ready within a few hundred ms
+            uploaded_file = _poll(
+                uploaded_file,
+                refresh=lambda f: self.client.files.get(name=f.name),
+                pending=lambda f: f.state.name == "PROCESSING",
+                timeout=UPLOAD_PROCESSING_TIMEOUT,
+                what=f"File {uploaded_file.name} processing"
+            )
 
             if uploaded_file.state.name == "FAILED":
                 raise ValueError(f"File upload failed: {uploaded_file.error.message}")
 
             # Add google_file_name to metadata for cleanup
-            metadata.append({'key': 'google_file_name', 'string_value': uploaded_file.name})
+            metadata.append(_md('google_file_name', uploaded_file.name))
 
             # Import to store with metadata
-            print(f"[FileStoreManager] Importing to store {store_name} with metadata...")
-            self.client.file_search_stores.import_file(
+            logger.debug("[FileStoreManager] Importing to store %s with metadata...", store_name)
+            operation = self.client.file_search_stores.import_file(
                 file_search_store_name=store_name,
                 file_name=uploaded_file.name,
                 config={'custom_metadata': metadata}
             )
 
-            print(f"[FileStoreManager] Successfully imported: {uploaded_file.name}")
-            return uploaded_file.name
+            # import_file is a long-running operation; until it is done file_search can't see
+            # the document, and an extraction would come back empty
+            operation = _poll(
+                operation,
+                refresh=self.client.operations.get,
+                pending=lambda op: not op.done,
+                timeout=IMPORT_INDEXING_TIMEOUT,
+                what=f"Import of {uploaded_file.name}"
+            )
+            if operation.error:
+                raise ValueError(f"File import failed: {operation.error}")
 
-        except Exception as e:
-            print(f"[FileStoreManager] Error uploading file: {e}")
-            raise
+            # The new document is not in any cached listing
+            with self._doc_index_lock:
+                self._doc_index.pop(store_name, None)
 
-    def _get_or_create_store(self, display_name: str) -> str:
-        """Gets existing store or creates new one."""
-        # Check cache
-        if display_name == self.USER_STORE_NAME and self._user_store_id:
-            return self._user_store_id
+            logger.debug("[FileStoreManager] Successfully imported: %s", uploaded_file.name)
+            return uploaded_file
 
-        # Search existing stores
-        try:
-            for store in self.client.file_search_stores.list():
-                if store.display_name == display_name:
-                    print(f"[FileStoreManager] Using existing store: {store.name}")
-                    self._user_store_id = store.name
-                    return store.name
         except Exception as e:
-            print(f"[FileStoreManager] Error listing stores: {e}")
+            logger.error("[FileStoreManager] Error importing file: %s", e)
+            raise
 
-        # Create new store
-        print(f"[FileStoreManager] Creating new store: {display_name}")
-        new_store = self.client.file_search_stores.create(
-            config={'display_name': display_name}
-        )
+    def _get_or_create_store(self, display_name: str, refresh: bool = False) -> str:
+        """
+        Gets existing store or creates new one.
+        Pass refresh=True to drop the cached entry, e.g. if the store was recreated out-of-band.
+        """
+        # Fast path without the lock; an expired entry falls through and is re-resolved
+        store_id = _cached_store_id(display_name)
+        if store_id and not refresh:
+            return store_id
+
+        # One thread resolves at a time, so concurrent misses can't each create a store
+        with _STORE_LOCK:
+            if refresh:
+                _STORE_CACHE.pop(display_name, None)
+                _STORE_EXPIRY.pop(display_name, None)
+            elif _cached_store_id(display_name):
+                return _STORE_CACHE[display_name]
+
+            # Search existing stores
+            try:
+                for store in self.client.file_search_stores.list(config={'page_size': STORE_LIST_PAGE_SIZE}):
+                    if store.display_name == display_name:
+                        logger.info("[FileStoreManager] Using existing store: %s", store.name)
+                        _remember_store_id(display_name, store.name)
+                        return store.name
+            except Exception as e:
+                logger.warning("[FileStoreManager] Error listing stores: %s", e)
+
+            # Create new store
+            logger.info("[FileStoreManager] Creating new store: %s", display_name)
+            new_store = self.client.file_search_stores.create(
+                config={'display_name': display_name}
+            )
 
-        self._user_store_id = new_store.name
-        return new_store.name
\ No newline at end of file
+            _remember_store_id(display_name, new_store.name)
+            return new_store.name
@@ -0,0 +1,47 @@
+"""
+Shared Gemini Client
+
+A single genai.Client per process, so every module reuses one HTTP
+connection pool instead of opening its own.
+"""
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import httpx
+
+if TYPE_CHECKING:
+    from google import genai
+
+# The sync and aio transports each keep their own pool with these limits; idle connections stay warm between requests
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+HTTP_TIMEOUT_MS = 60_000
+
+
+@lru_cache(maxsize=1)
+def load_env() -> None:
+    """Loads .env into os.environ once per process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_client() -> genai.Client:
+    """Returns the process-wide Gemini client, creating it on first use."""
+    # The SDK is heavy to import; defer it until a client is actually needed
+    from google import genai
+    from google.genai import types
+
+    load_env()
+    return genai.Client(
+        api_key=os.getenv("GOOGLE_API_KEY"),
+        http_options=types.HttpOptions(
+            timeout=HTTP_TIMEOUT_MS,
+            # HTTP/2 lets concurrent calls multiplex over one connection. Passing explicit
+            # transports also keeps the SDK on httpx even when aiohttp is installed.
+            client_args={"transport": httpx.HTTPTransport(http2=True, limits=HTTP_LIMITS)},
+            async_client_args={"transport": httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS)}
+        )
+    )
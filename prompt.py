@@ -1,5 +1,10 @@
+from string import Template
+
 # --- PROMPT TEMPLATES ---
 
+# Bump whenever Extract_rules_prompt changes so previously cached rules are not reused
+EXTRACT_PROMPT_VERSION = "1"
+
 Extract_rules_prompt = """
 You are a Senior Legal Compliance Architect.
 
@@ -47,26 +52,24 @@ Your job is to compare 'USER CONTENT' vs 'JSON RULES' and report discrepancies.
 """
 
 
-def get_verify_compliance_prompt(rules: str, user_input: str) -> str:
-    """
-    Returns the verification prompt with rules and user input filled in.
-    
-    Args:
-        rules: The extracted JSON rules from the policy document
-        user_input: The user's content to check for compliance
-        
-    Returns:
-        Formatted prompt string
-    """
-    return f"""
+# Stands in for extracted rules when the policy PDF itself is attached to the verify call
+INLINE_RULES_REFERENCE = """
+The RULES are the attached Policy Document. Use ONLY the rules explicitly written in it,
+grouped as data_privacy_pii, citation_style, structure_formatting, phrasing_governance.
+Any category the document does not address is "None explicitly stated." and cannot produce violations.
+"""
+
+
+# Static text is parsed once; only $rules and $user_input are filled per call
+VERIFY_PROMPT_TEMPLATE = Template("""
 --- STEP 1: READ THE RULES ---
-{rules}
+$rules
 
 The RULES above are a JSON object with four arrays: data_privacy_pii, citation_style, structure_formatting, phrasing_governance.
 Treat this JSON as the COMPLETE and ONLY rule source.
 
 --- STEP 2: READ THE USER CONTENT ---
-{user_input}
+$user_input
 
 CRITICAL OVERRIDES:
 1. IGNORE TRUTH
@@ -99,28 +102,64 @@ Compare USER CONTENT against the JSON RULES. A violation exists only when:
 - Some span of USER CONTENT conflicts with that rule.
 
 OUTPUT STRICT JSON SCHEMA:
-{{
+{
   "is_compliant": boolean,
   "overallScore": float(1-100),
   "detectionConfidence": "LOW", "MEDIUM", or "HIGH",
   "totalViolations": int,
   "violations": [
-    {{
+    {
       "rule_category": string,          
       "rule_reference": string,         
       "violation_text": string,         
       "correction_suggestion": string,  
       "severity": string                
-    }}
+    }
   ]
-}}
+}
 
 If there are no violations, return:
-{{
+{
   "is_compliant": true,
   "overallScore": 100,
   "detectionConfidence": "HIGH",
   "totalViolations": 0,
   "violations": []
-}}
+}
+""")
+
+
+def get_verify_compliance_prompt(rules: str, user_input: str) -> str:
+    """
+    Returns the verification prompt with rules and user input filled in.
+    
+    Args:
+        rules: The extracted JSON rules from the policy document
+        user_input: The user's content to check for compliance
+        
+    Returns:
+        Formatted prompt string
+    """
+    return VERIFY_PROMPT_TEMPLATE.substitute(rules=rules, user_input=user_input)
+
+
+def get_verify_compliance_batch_prompt(rules: str, drafts: list) -> str:
+    """
+    Returns a verification prompt that checks several drafts against the same rules in one call.
+    
+    Args:
+        rules: The extracted JSON rules from the policy document
+        drafts: The user contents to check, in order
+        
+    Returns:
+        Formatted prompt string asking for one report per draft
+    """
+    drafts_block = "\n".join(
+        f"[DRAFT_{i}]\n{draft}\n[/DRAFT_{i}]" for i, draft in enumerate(drafts, 1)
+    )
+    return get_verify_compliance_prompt(rules, drafts_block) + f"""
+--- BATCH MODE ---
+USER CONTENT above contains {len(drafts)} independent drafts delimited by [DRAFT_n] ... [/DRAFT_n] tags.
+Check each draft on its own against the RULES; never let one draft affect another draft's report.
+Return a JSON array with exactly {len(drafts)} report objects (schema above), in draft order.
 """
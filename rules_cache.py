@@ -0,0 +1,89 @@
+"""
+Extracted Rules Cache
+
+Persists the text produced by the extract stage so repeat compliance checks
+against the same rules document skip the file_search LLM call entirely.
+Backed by SQLite (WAL mode) so entries survive restarts and are shared
+between worker processes on the same host. There is deliberately no
+in-process layer: a delete in one worker must be seen by all of them.
+
+Every call is blocking SQLite I/O (up to a 5 s busy wait); call it from
+a worker thread when on an event loop.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from gemini_client import load_env
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def make_key(*parts: Optional[str]) -> str:
+    """Builds a stable cache key from the given parts."""
+    return hashlib.sha256("|".join(p or "" for p in parts).encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def cache_path() -> Path:
+    """Database location; resolved on first use so RULES_CACHE_PATH may come from .env."""
+    load_env()
+    return Path(os.getenv(
+        "RULES_CACHE_PATH",
+        Path.home() / ".cache" / "compliance" / "rules_cache.sqlite3"
+    ))
+
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                cache_path().parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(cache_path())) as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS rules "
+                        "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                    )
+                    conn.commit()
+                _initialized = True
+    return sqlite3.connect(cache_path(), timeout=5)
+
+
+def lookup(key: str) -> Optional[str]:
+    """Returns the cached value, or None if missing or expired."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT value FROM rules WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+    return row[0] if row else None
+
+
+def store(key: str, value: str, ttl: float = DEFAULT_TTL_SECONDS) -> None:
+    """Stores a value for ttl seconds."""
+    with closing(_connect()) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO rules (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl)
+        )
+        conn.commit()
+
+
+def delete(key: str) -> None:
+    """Evicts a key if present."""
+    with closing(_connect()) as conn:
+        conn.execute("DELETE FROM rules WHERE key = ?", (key,))
+        conn.commit()
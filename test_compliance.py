@@ -5,10 +5,11 @@ Tests the user-upload flow with local file paths
 import warnings
 warnings.filterwarnings("ignore", message="Core Pydantic V1 functionality")
 
-import json
 import time
 from pathlib import Path
 
+import orjson
+
 # Import from local modules
 from compliance import (
     upload_user_rules,
@@ -53,6 +54,11 @@ Phone: 9123456789
 """
 
 
+def _pretty(result) -> str:
+    """Indented JSON for result dumps; orjson keeps large reports cheap to print."""
+    return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
+
+
 # ============================================================================
 # TEST FUNCTIONS
 # ============================================================================
@@ -78,7 +84,7 @@ def test_simple_compliance_check():
     )
     
     print(f"\n[RESULT]:")
-    print(json.dumps(result, indent=2))
+    print(_pretty(result))
     
     if result.get("status") == "success":
         report = result.get("report", {})
@@ -117,7 +123,7 @@ def test_upload_then_check():
         user_id=TEST_USER_ID,
         file_id=file_id
     )
-    print(f"Upload Result: {json.dumps(upload_result, indent=2)}")
+    print(f"Upload Result: {_pretty(upload_result)}")
     
     if upload_result.get("status") != "success":
         print("[ERROR] Upload failed!")
@@ -131,30 +137,141 @@ def test_upload_then_check():
         draft_text=TEST_DRAFT_WITH_VIOLATIONS,
         cleanup_after=False  # Don't cleanup yet
     )
-    print(f"Check Result: {json.dumps(check_result, indent=2)}")
+    print(f"Check Result: {_pretty(check_result)}")
     
     # Step 3: Manual cleanup
     print("\n[STEP 3] Cleaning up uploaded rules...")
     delete_result = delete_user_rules(TEST_USER_ID, file_id)
-    print(f"Delete Result: {json.dumps(delete_result, indent=2)}")
+    print(f"Delete Result: {_pretty(delete_result)}")
     
     print("\n[DONE] Two-step flow completed!")
     return check_result
 
 
+def test_has_any_rule():
+    """
+    Offline test: only an all-"None explicitly stated." extraction may skip verification
+    """
+    from compliance import _has_any_rule
+
+    print("\n" + "="*70)
+    print("[TEST] RULE DETECTION (no API calls)")
+    print("="*70)
+
+    empty = (
+        "**1. Data Privacy / PII**\n"
+        "- None explicitly stated.\n"
+        "**2. Citation Style**\n"
+        "- None explicitly stated.\n"
+        "**3. Document Structure & Formatting**\n"
+        "- Required headings: None explicitly stated.\n"
+        "**4. Restricted/Required Phrasing (Governance)**\n"
+        "- None explicitly stated.\n"
+    )
+    assert not _has_any_rule(empty)
+
+    # A rule sharing its bullet with a "None" sub-aspect
+    mixed = empty.replace(
+        "- Required headings: None explicitly stated.",
+        "- Full names must be disclosed; dates: None explicitly stated."
+    )
+    assert _has_any_rule(mixed)
+
+    # A rule written as a paragraph under its heading
+    paragraph = empty.replace(
+        "- Required headings: None explicitly stated.",
+        "The filing must open with the heading IN THE HIGH COURT."
+    )
+    assert _has_any_rule(paragraph)
+
+    # Numbered sub-items instead of bullets
+    numbered = empty.replace(
+        "**2. Citation Style**\n- None explicitly stated.",
+        "**2. Citation Style**\n1. Phone numbers must be redacted."
+    )
+    assert _has_any_rule(numbered)
+
+    print("\n[DONE] Rule detection checks passed!")
+
+
+def test_retry_delay():
+    """
+    Offline test: server retry hints are honoured and capped; without one, backoff applies
+    """
+    import httpx
+    from google.genai import errors
+    from compilance_states import _server_retry_delay, _retry_delay, MAX_RETRY_DELAY
+
+    print("\n" + "="*70)
+    print("[TEST] RETRY DELAYS (no API calls)")
+    print("="*70)
+
+    def quota_error(retry_after=None, retry_delay=None):
+        details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}] if retry_delay else []
+        body = {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED", "details": details}}
+        headers = {"retry-after": retry_after} if retry_after else {}
+        return errors.ClientError(429, body, httpx.Response(429, headers=headers, json=body))
+
+    # Retry-After header, then RetryInfo in the error body
+    assert _server_retry_delay(quota_error(retry_after="7")) == 7.0
+    assert _server_retry_delay(quota_error(retry_delay="12.5s")) == 12.5
+    assert _server_retry_delay(quota_error(retry_after="3", retry_delay="30s")) == 3.0
+
+    # Unparseable or missing hints fall through to None
+    assert _server_retry_delay(quota_error(retry_after="Wed, 21 Oct 2026 07:28:00 GMT")) is None
+    assert _server_retry_delay(quota_error(retry_delay="soon")) is None
+    assert _server_retry_delay(quota_error()) is None
+    assert _server_retry_delay(ValueError("no response")) is None
+
+    # A server hint wins but is capped
+    assert _retry_delay(quota_error(retry_delay="12s"), attempt=1) == 12.0
+    assert _retry_delay(quota_error(retry_delay="600s"), attempt=1) == MAX_RETRY_DELAY
+
+    # Quota errors without a hint: at least 10s plus up to 5s jitter, growing and capped
+    for attempt, low in ((1, 10), (3, 20), (10, MAX_RETRY_DELAY)):
+        delay = _retry_delay(quota_error(), attempt)
+        assert low <= delay <= low + 5, (attempt, delay)
+
+    # Other transient errors back off quickly: 1s, 2s, then capped at 4s
+    server_error = errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+    assert [_retry_delay(server_error, a) for a in (1, 2, 3, 4)] == [1, 2, 4, 4]
+
+    print("\n[DONE] Retry delay checks passed!")
+
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
+TESTS = {
+    "simple": test_simple_compliance_check,
+    "two-step": test_upload_then_check,
+    "rules": test_has_any_rule,
+    "retry": test_retry_delay,
+}
+
+USAGE = f"Usage: python test_compliance.py [{'|'.join(TESTS)}|all]  (default: simple)"
+
+
 if __name__ == "__main__":
+    import sys
+    import logging
+
+    # Show the engine's stage logs alongside the test output
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("compliance").setLevel(logging.DEBUG)
+    logging.getLogger("compliance_file_store").setLevel(logging.DEBUG)
+
+    name = sys.argv[1].lower() if len(sys.argv) > 1 else "simple"
+    if name != "all" and name not in TESTS:
+        print(USAGE)
+        sys.exit(0 if name in ("-h", "--help") else 2)
+
     print("\n" + "="*70)
     print("COMPLIANCE ENGINE TEST SUITE")
     print("="*70)
     print(f"Rules PDF: {RULES_PDF_PATH}")
     print(f"PDF exists: {Path(RULES_PDF_PATH).exists()}")
     
-    # Run simple test
-    test_simple_compliance_check()
-    
-    # Uncomment to also run the two-step test:
-    # test_upload_then_check()
+    for test in (TESTS.values() if name == "all" else [TESTS[name]]):
+        test()